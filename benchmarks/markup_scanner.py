@@ -0,0 +1,118 @@
+import argparse
+import html
+import os
+import random
+import re
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from core.quest import format_markup
+
+
+LEGACY_VARIABLE_GROUP_RE = r"(?:\{[^{}]+\})+"
+LEGACY_RUBY_RE = r"\s*(\S+)\{RUBY#\[.\](.+)\}(\S+)\s*"
+
+
+# Inline markup handling as it was done in classify_dialogue before the single-pass scanner
+def legacy_format_markup(text: str) -> tuple[str, list[str]]:
+    formatted_text = text
+    variable_text = []
+
+    for variable_group in re.finditer(LEGACY_VARIABLE_GROUP_RE, text):
+        matched_text = variable_group[0]
+
+        if r"{RUBY#" in matched_text:
+            for ruby_group in re.finditer(LEGACY_RUBY_RE, text):
+                matched_ruby = ruby_group[0]
+
+                base_text = html.escape(ruby_group[1] + ruby_group[3])
+                ruby_text = html.escape(ruby_group[2])
+
+                formatted_ruby = """<custom-ruby data-ruby="%s|%s"></custom-ruby>""" % (base_text, ruby_text)
+
+                formatted_text = text.replace(matched_ruby, formatted_ruby)
+        elif r"{NON_BREAK_SPACE}" in matched_text:
+            formatted_text = text.replace(r"{NON_BREAK_SPACE}", "&nbsp;")
+        else:
+            variable_text.append(matched_text)
+
+    return formatted_text, variable_text
+
+
+def generate_line(rng: random.Random, markup_amount: int) -> str:
+    words = []
+
+    for _ in range(markup_amount):
+        words.append(rng.choice(["Hello", "there", "Traveler", "稲妻", "the", "Archon"]))
+
+        match rng.randrange(4):
+            case 0:
+                words.append("雷{RUBY#[S]かみ}神")
+            case 1:
+                words.append("{NON_BREAK_SPACE}")
+            case 2:
+                words.append("{NICKNAME}")
+            case 3:
+                words.append("{M#he}{F#she}")
+
+    return " ".join(words)
+
+
+# The same markup in Chinese text, where nothing separates the words
+def generate_unspaced_line(rng: random.Random, markup_amount: int) -> str:
+    words = []
+
+    for _ in range(markup_amount):
+        words.append(rng.choice(["我们应该去", "稻妻城", "旅行者", "风神的", "璃月港的星星", "现在吧"]))
+
+        match rng.randrange(4):
+            case 0:
+                words.append("雷{RUBY#[S]かみ}神")
+            case 1:
+                words.append("{NON_BREAK_SPACE}")
+            case 2:
+                words.append("{NICKNAME}")
+            case 3:
+                words.append("{M#他}{F#她}")
+
+    return "".join(words)
+
+
+def time_scanner(scanner, lines: list[str], repeat: int) -> float:
+    best_time = float("inf")
+
+    for _ in range(repeat):
+        start_time = time.perf_counter()
+
+        for line in lines:
+            scanner(line)
+
+        best_time = min(best_time, time.perf_counter() - start_time)
+
+    return best_time
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description = "Compares the inline markup scanner of the Quest Formatter with its previous implementation.")
+    parser.add_argument("--lines", type = int, default = 2000, help = "number of generated lines")
+    parser.add_argument("--markup", type = int, default = 40, help = "number of markup tokens per line")
+    parser.add_argument("--repeat", type = int, default = 5, help = "number of timed runs, the best one is kept")
+    args = parser.parse_args()
+
+    for line_kind, generate in (("spaced", generate_line), ("unspaced", generate_unspaced_line)):
+        rng = random.Random(0)
+        lines = [generate(rng, args.markup) for _ in range(args.lines)]
+        megabytes = sum(len(line.encode()) for line in lines) / 1e6
+
+        print("%s lines (%s), %s markup tokens per line, %.2f MB" % (args.lines, line_kind, args.markup, megabytes))
+
+        for scanner_name, scanner in (("legacy", legacy_format_markup), ("single-pass", format_markup)):
+            scanner_time = time_scanner(scanner, lines, args.repeat)
+
+            print("%-12s %8.1f ms %8.2f MB/s %10.0f lines/s" % (scanner_name, scanner_time * 1000, megabytes / scanner_time, args.lines / scanner_time))
+
+
+if __name__ == "__main__":
+    main()
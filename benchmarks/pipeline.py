@@ -0,0 +1,354 @@
+import argparse
+import gc
+import io
+import json
+import os
+import platform
+import random
+import sys
+import time
+import tracemalloc
+from collections.abc import Callable
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import pandas as pd
+
+from core.pgc import create_batch_sheet, get_target_rows, read_batch_text
+from core.quest import classify_dialogue, format_dialogue, replace_variable_text
+from core.translation_memory import LANGUAGES
+
+
+PGC_LANGUAGE_AMOUNTS = (13, 15)
+PGC_OBJECT_AMOUNTS = (10, 100, 1000)
+QUEST_ROW_AMOUNTS = (1000, 10000, 100000)
+UNSPACED_QUEST_ROW_AMOUNTS = (1000, 10000)
+
+# Differences below these are noise, whatever their ratio
+MIN_SECONDS_DIFFERENCE = 0.002
+MIN_MEMORY_MB_DIFFERENCE = 0.5
+
+SPEAKERS = ("Paimon", "Traveler", "Kaeya", "Jean", "Lisa", "Amber", "Diluc", "Venti")
+LOCATIONS = ("Mondstadt, Cathedral", "Liyue Harbor, Wangsheng Funeral Parlor", "Inazuma City, Tenshukaku")
+WORDS = ("the", "Traveler", "wind", "Archon", "stars", "harbor", "we", "should", "go", "now", "稲妻", "璃月")
+UNSPACED_WORDS = ("我们", "应该", "去", "稻妻城", "旅行者", "风神", "璃月港", "的", "了", "吧", "星星", "现在")
+
+
+# A template in the layout of the PGC spreadsheets: identifier, type and field, then one column per language.
+# Every other row is a target row, the others already have their text.
+def generate_pgc_template(language_amount: int, target_row_amount: int) -> pd.DataFrame:
+    rows = [["ID", "Type", "Field"] + list(LANGUAGES[:language_amount])]
+
+    for row_counter in range(target_row_amount * 2):
+        row_id = str(100000 + row_counter)
+
+        if row_counter % 2 == 0:
+            rows.append([row_id, "TextMap", "Field%s" % row_counter] + [""] * language_amount)
+        else:
+            rows.append([row_id, "Config", "Fixed%s" % row_counter] + ["%s %s" % (language, row_counter) for language in LANGUAGES[:language_amount]])
+
+    rows.append(["", "", "Notes"] + [""] * language_amount)
+
+    return pd.DataFrame(rows, dtype = object)
+
+
+# The batch text of a target row, as copied from a spreadsheet: one line per object, one value per language.
+# Some rows are links (a single value), and some cells hold line breaks, tabs or quotes and are quoted.
+def generate_batch_text(rng: random.Random, language_amount: int, object_amount: int, link: bool) -> str:
+    lines = []
+
+    for object_counter in range(object_amount):
+        if link:
+            lines.append("https://example.com/images/%s_%s.png" % (rng.randrange(10 ** 6), object_counter))
+            continue
+
+        values = []
+
+        for language in LANGUAGES[:language_amount]:
+            value = "%s %s %s" % (language, object_counter, " ".join(rng.choice(WORDS) for _ in range(rng.randint(3, 12))))
+
+            if rng.random() < 0.1:
+                values.append('"%s\n""%s""\t%s"' % (value, rng.choice(WORDS), rng.choice(WORDS)))
+            else:
+                values.append(value)
+
+        lines.append("\t".join(values))
+
+    return "\n".join(lines)
+
+
+def generate_spaced_line(rng: random.Random) -> str:
+    words = [rng.choice(WORDS) for _ in range(rng.randint(4, 20))]
+
+    # Rubies, placeholders and non-breaking spaces
+    if rng.random() < 0.1:
+        words.insert(rng.randrange(len(words)), "雷{RUBY#[S]かみ}神")
+
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words)), "{NICKNAME}")
+
+    if rng.random() < 0.1:
+        words.insert(rng.randrange(len(words)), "{M#he}{F#she}")
+
+    if rng.random() < 0.05:
+        words.append("{NON_BREAK_SPACE}!")
+
+    return " ".join(words)
+
+
+# A Chinese line of 100 to 400 characters without any space, as most of the wiki's text is, with the same markup
+def generate_unspaced_line(rng: random.Random) -> str:
+    line_length = rng.randint(100, 400)
+    words = []
+
+    while sum(len(word) for word in words) < line_length:
+        words.append(rng.choice(UNSPACED_WORDS))
+
+    if rng.random() < 0.3:
+        words.insert(rng.randrange(len(words)), "雷{RUBY#[S]かみ}神")
+
+    if rng.random() < 0.5:
+        words.insert(rng.randrange(len(words)), "{NICKNAME}")
+
+    if rng.random() < 0.2:
+        words.insert(rng.randrange(len(words)), "{M#他}{F#她}")
+
+    if rng.random() < 0.1:
+        words.append("{NON_BREAK_SPACE}！")
+
+    return "".join(words)
+
+
+# A dialogue as pasted in the Quest Formatter, mixing every row type classify_dialogue knows about
+def generate_quest_sheet(rng: random.Random, row_amount: int, unspaced: bool = False) -> tuple[list[str], list[str]]:
+    generate_line = generate_unspaced_line if unspaced else generate_spaced_line
+
+    rows = [("Quest Desc", generate_line(rng)), ("Quest Objective", generate_line(rng))]
+
+    while len(rows) < row_amount:
+        speaker = rng.choice(SPEAKERS)
+        row_kind = rng.random()
+
+        if row_kind < 0.5:
+            rows.append((speaker, generate_line(rng)))
+        elif row_kind < 0.6:
+            rows.append(("", "*%s %s*" % (speaker, generate_line(rng))))
+        elif row_kind < 0.66:
+            rows.append(("", ""))
+        elif row_kind < 0.71:
+            rows.append((rng.choice(LOCATIONS), ""))
+        elif row_kind < 0.77:
+            rows += [
+                ("Choice", ""),
+                ("1. %s" % speaker, generate_line(rng)),
+                (rng.choice(SPEAKERS), generate_line(rng)),
+                ("2. %s" % speaker, generate_line(rng)),
+                (rng.choice(SPEAKERS), generate_line(rng)),
+                ("", "")
+            ]
+        elif row_kind < 0.82:
+            rows += [(rng.choice(("Additional Dialogue", "Alternative Dialogue", "Optional Dialogue")), ""), (speaker, generate_line(rng)), ("", "")]
+        elif row_kind < 0.86:
+            rows.append((str(rng.randint(1, 9)), generate_line(rng)))
+        elif row_kind < 0.88:
+            rows.append(("Missing Translation", generate_line(rng)))
+        elif row_kind < 0.92:
+            rows.append(("Sub Mission %s" % rng.randint(1, 9), ""))
+        else:
+            rows.append(("%s {NICKNAME}" % speaker, generate_line(rng)))
+
+    return [header for header, _ in rows[:row_amount]], [text for _, text in rows[:row_amount]]
+
+
+# Best wall time of `repeat` runs, then the peak memory of one more run (tracing slows the code down).
+# `setup` builds fresh arguments for each run, outside of the measure.
+def measure(run: Callable, setup: Callable[[], tuple], repeat: int) -> dict:
+    best_time = float("inf")
+
+    for _ in range(repeat):
+        args = setup()
+
+        # As timeit does, garbage collections left by the previous runs are not timed
+        gc.collect()
+        gc.disable()
+
+        try:
+            start_time = time.perf_counter()
+            run(*args)
+            best_time = min(best_time, time.perf_counter() - start_time)
+        finally:
+            gc.enable()
+
+    args = setup()
+
+    tracemalloc.start()
+
+    try:
+        run(*args)
+        peak_memory = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+    return {"seconds": round(best_time, 6), "peak_memory_mb": round(peak_memory / 1024 / 1024, 3)}
+
+
+def benchmark_pgc(language_amount: int, object_amount: int, target_row_amount: int, repeat: int) -> dict:
+    rng = random.Random(language_amount * object_amount)
+
+    template_df = generate_pgc_template(language_amount, target_row_amount)
+    batch_texts = [generate_batch_text(rng, language_amount, object_amount, link = row_counter % 4 == 3) for row_counter in range(target_row_amount)]
+
+    # get_target_rows casts the identifiers of the template in place
+    processed_template_df = template_df.copy()
+    target_rows = get_target_rows(processed_template_df)
+
+    def read_target_rows() -> dict:
+        filled_target_rows = get_target_rows(template_df.copy())
+        read_batch_text(filled_target_rows, batch_texts)
+
+        return filled_target_rows
+
+    return {
+        "get_target_rows": measure(get_target_rows, lambda: (template_df.copy(),), repeat),
+        "read_batch_text": measure(read_batch_text, lambda: (target_rows, batch_texts), repeat),
+        "create_batch_sheet": measure(create_batch_sheet, lambda: (processed_template_df, read_target_rows(), io.BytesIO()), repeat)
+    }
+
+
+def benchmark_quest(row_amount: int, repeat: int, unspaced: bool = False) -> dict:
+    headers, texts = generate_quest_sheet(random.Random(row_amount), row_amount, unspaced)
+
+    classified_dialogue, variable_text = classify_dialogue(headers, texts)
+
+    translations = {og_text: og_text.upper() for og_text in variable_text}
+
+    replaced_dialogue = replace_variable_text(classified_dialogue, translations)
+
+    return {
+        "classify_dialogue": measure(classify_dialogue, lambda: (headers, texts), repeat),
+        "replace_variable_text": measure(replace_variable_text, lambda: (classified_dialogue, translations), repeat),
+        "format_dialogue": measure(format_dialogue, lambda: (replaced_dialogue,), repeat),
+        "format_dialogue_compact": measure(lambda dialogue: format_dialogue(dialogue, compact = True), lambda: (replaced_dialogue,), repeat)
+    }
+
+
+def run_benchmarks(args: argparse.Namespace) -> dict:
+    object_amounts = PGC_OBJECT_AMOUNTS[:2] if args.quick else PGC_OBJECT_AMOUNTS
+    row_amounts = QUEST_ROW_AMOUNTS[:2] if args.quick else QUEST_ROW_AMOUNTS
+    unspaced_row_amounts = UNSPACED_QUEST_ROW_AMOUNTS[:1] if args.quick else UNSPACED_QUEST_ROW_AMOUNTS
+
+    results = {}
+
+    if args.only in (None, "pgc"):
+        for language_amount in PGC_LANGUAGE_AMOUNTS:
+            for object_amount in object_amounts:
+                case_name = "pgc/%s languages/%s objects" % (language_amount, object_amount)
+
+                print("Running %s..." % case_name, file = sys.stderr)
+
+                results[case_name] = benchmark_pgc(language_amount, object_amount, args.target_rows, args.repeat)
+
+    if args.only in (None, "quest"):
+        for row_amount in row_amounts:
+            case_name = "quest/%s rows" % row_amount
+
+            print("Running %s..." % case_name, file = sys.stderr)
+
+            results[case_name] = benchmark_quest(row_amount, args.repeat)
+
+        for row_amount in unspaced_row_amounts:
+            case_name = "quest/%s unspaced rows" % row_amount
+
+            print("Running %s..." % case_name, file = sys.stderr)
+
+            results[case_name] = benchmark_quest(row_amount, args.repeat, unspaced = True)
+
+    return {
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "repeat": args.repeat,
+        "results": results
+    }
+
+
+def is_regression(value: float, baseline_value: float, threshold: float, min_difference: float) -> bool:
+    return value > baseline_value * (1 + threshold) and value - baseline_value > min_difference
+
+
+# Prints every stage next to its baseline. Returns the number of regressions.
+def compare_results(run: dict, baseline: dict, threshold: float, memory_threshold: float) -> int:
+    if run["machine"] != baseline["machine"]:
+        print("Warning: the baseline was recorded on another machine (%s)" % json.dumps(baseline["machine"]))
+
+    regression_amount = 0
+
+    for case_name, stages in run["results"].items():
+        for stage_name, result in stages.items():
+            baseline_result = baseline["results"].get(case_name, {}).get(stage_name)
+
+            if baseline_result is None:
+                print("%-30s %-24s %10.1f ms %9.2f MB   (no baseline)" % (case_name, stage_name, result["seconds"] * 1000, result["peak_memory_mb"]))
+                continue
+
+            flags = []
+
+            if is_regression(result["seconds"], baseline_result["seconds"], threshold, MIN_SECONDS_DIFFERENCE):
+                flags.append("SLOWER")
+
+            if is_regression(result["peak_memory_mb"], baseline_result["peak_memory_mb"], memory_threshold, MIN_MEMORY_MB_DIFFERENCE):
+                flags.append("MORE MEMORY")
+
+            regression_amount += len(flags)
+
+            print("%-30s %-24s %10.1f ms (%+6.1f%%) %9.2f MB (%+6.1f%%) %s" % (
+                case_name,
+                stage_name,
+                result["seconds"] * 1000,
+                (result["seconds"] / baseline_result["seconds"] - 1) * 100 if baseline_result["seconds"] else 0,
+                result["peak_memory_mb"],
+                (result["peak_memory_mb"] / baseline_result["peak_memory_mb"] - 1) * 100 if baseline_result["peak_memory_mb"] else 0,
+                " ".join(flags)
+            ))
+
+    return regression_amount
+
+
+def print_results(run: dict) -> None:
+    for case_name, stages in run["results"].items():
+        for stage_name, result in stages.items():
+            print("%-30s %-24s %10.1f ms %9.2f MB" % (case_name, stage_name, result["seconds"] * 1000, result["peak_memory_mb"]))
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description = "Times each stage of the PGC Creator and the Quest Formatter on synthetic data, and compares the results with a baseline.")
+    parser.add_argument("--save", metavar = "PATH", help = "write the results to a JSON baseline")
+    parser.add_argument("--compare", metavar = "PATH", help = "compare the results with a JSON baseline, exits with 1 on regressions")
+    parser.add_argument("--threshold", type = float, default = 0.2, help = "slowdown flagged as a regression (defaults to 0.2, i.e. 20%%)")
+    parser.add_argument("--memory-threshold", type = float, default = 0.2, help = "peak memory increase flagged as a regression (defaults to 0.2)")
+    parser.add_argument("--repeat", type = int, default = 5, help = "number of timed runs, the best one is kept")
+    parser.add_argument("--target-rows", type = int, default = 24, help = "number of target rows of the PGC templates")
+    parser.add_argument("--only", choices = ("pgc", "quest"), help = "only run the benchmarks of one tool")
+    parser.add_argument("--quick", action = "store_true", help = "skip the largest sizes")
+    args = parser.parse_args()
+
+    run = run_benchmarks(args)
+
+    if args.save:
+        with open(args.save, "w", encoding = "utf-8") as baseline_file:
+            json.dump(run, baseline_file, indent = 2)
+
+    if not args.compare:
+        print_results(run)
+        return 0
+
+    with open(args.compare, encoding = "utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regression_amount = compare_results(run, baseline, args.threshold, args.memory_threshold)
+
+    print("%s regression(s)" % regression_amount)
+
+    return 1 if regression_amount else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+import argparse
+import copy
+import csv
+import io
+import multiprocessing
+import os
+import random
+import sys
+from concurrent.futures import ProcessPoolExecutor
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from openpyxl import Workbook, load_workbook
+
+from pipeline import generate_batch_text, generate_pgc_template, generate_quest_sheet
+
+from core.pgc import create_batch_sheet, get_target_rows, read_batch_text
+from core.quest import DialogueCache, PARALLEL_CHUNK_ROWS, classify_dialogue, format_dialogue, format_dialogue_parallel, get_segments, render_segments, replace_variable_text
+from core.tsv import iter_tsv_rows
+
+
+TSV_CHARACTERS = ("a", "b", "稲妻", " ", "\t", "\n", '"', "&", "<", "{NICKNAME}")
+
+# Batch text values that the spreadsheet must keep as they are
+EDGE_CASE_VALUES = (" leading space", "trailing space ", "001", "1.5", "a & b <c>", "line\nbreak", "tab\tbetween", "", "稲妻 {NICKNAME}")
+
+
+# The PGC spreadsheet as the PGC Creator wrote it with openpyxl before the sheets were stamped from a compiled template
+def write_reference_batch_sheet(template_df, target_rows: dict, batch_file) -> None:
+    target_rows_idx = target_rows["idx"]
+    target_rows_tsv = target_rows["tsv_text"]
+    language_amount = target_rows["language_amount"]
+
+    template_rows = [[None if value == "" else value for value in row] for row in template_df.values.tolist()]
+
+    batch_workbook = Workbook(write_only = True)
+
+    for processed_df_counter in range(len(target_rows_tsv[0])):
+        object_lines = {}
+
+        for row_counter, row_idx in enumerate(target_rows_idx):
+            object_line = target_rows_tsv[row_counter][processed_df_counter]
+
+            if len(object_line) == 1:
+                object_line = object_line * language_amount
+
+            object_lines[row_idx] = [None if value == "" else value for value in object_line]
+
+        worksheet = batch_workbook.create_sheet("Sheet%s" % processed_df_counter)
+
+        for row_idx, row in enumerate(template_rows):
+            if row_idx in object_lines:
+                row = row[:3] + object_lines[row_idx] + row[3 + language_amount:]
+
+            worksheet.append(row)
+
+    batch_workbook.save(batch_file)
+
+
+def read_workbook_values(batch_file) -> list[tuple[str, list[tuple]]]:
+    batch_file.seek(0)
+
+    batch_workbook = load_workbook(batch_file, read_only = True)
+
+    # Trailing empty cells are not written by every writer
+    workbook_values = [
+        (worksheet.title, [tuple(None if value == "" else value for value in row) for row in worksheet.iter_rows(values_only = True)])
+        for worksheet in batch_workbook.worksheets
+    ]
+
+    batch_workbook.close()
+
+    return workbook_values
+
+
+def check_pgc(rng: random.Random, language_amount: int, object_amount: int) -> list[str]:
+    template_df = generate_pgc_template(language_amount, 6)
+    target_rows = get_target_rows(template_df)
+
+    batch_texts = [generate_batch_text(rng, language_amount, object_amount, link = row_counter % 3 == 2) for row_counter in range(len(target_rows["idx"]))]
+
+    # One more object, made of the values the writer must not alter in the first target row
+    edge_case_values = (EDGE_CASE_VALUES * language_amount)[:language_amount]
+    batch_texts[0] += "\n" + "\t".join('"%s"' % value if "\n" in value or "\t" in value else value for value in edge_case_values)
+
+    for row_counter in range(1, len(batch_texts)):
+        batch_texts[row_counter] += "\n" + generate_batch_text(rng, language_amount, 1, link = row_counter % 3 == 2)
+
+    read_batch_text(target_rows, batch_texts)
+
+    # Each writer duplicates the links of its own copy
+    batch_file = io.BytesIO()
+    create_batch_sheet(template_df, copy.deepcopy(target_rows), batch_file)
+
+    reference_file = io.BytesIO()
+    write_reference_batch_sheet(template_df, copy.deepcopy(target_rows), reference_file)
+
+    batch_values = read_workbook_values(batch_file)
+    reference_values = read_workbook_values(reference_file)
+
+    if [sheet_name for sheet_name, _ in batch_values] != [sheet_name for sheet_name, _ in reference_values]:
+        return ["sheet names differ"]
+
+    for (sheet_name, sheet_values), (_, reference_sheet_values) in zip(batch_values, reference_values):
+        for row_number, (row, reference_row) in enumerate(zip(sheet_values, reference_sheet_values), start = 1):
+            if row != reference_row:
+                return ["%s row %s: %r, expected %r" % (sheet_name, row_number, row, reference_row)]
+
+        if len(sheet_values) != len(reference_sheet_values):
+            return ["%s has %s rows, expected %s" % (sheet_name, len(sheet_values), len(reference_sheet_values))]
+
+    return []
+
+
+# Tab-separated values as Excel copies them, with quoted cells, empty lines and both kinds of line breaks
+def generate_tsv(rng: random.Random, row_amount: int) -> str:
+    lines = []
+
+    for _ in range(row_amount):
+        if rng.random() < 0.1:
+            lines.append("")
+            continue
+
+        cells = []
+
+        for _ in range(rng.randint(1, 5)):
+            cell = "".join(rng.choice(TSV_CHARACTERS) for _ in range(rng.randint(0, 6)))
+
+            if any(char in cell for char in "\t\n\"") or rng.random() < 0.1:
+                cell = '"%s"' % cell.replace('"', '""')
+
+            cells.append(cell)
+
+        lines.append("\t".join(cells))
+
+    return rng.choice(("\n", "\r\n")).join(lines)
+
+
+def check_tsv(rng: random.Random, case_amount: int) -> list[str]:
+    for case_counter in range(case_amount):
+        tsv_text = generate_tsv(rng, rng.randint(0, 12))
+
+        reference_rows = list(csv.reader(io.StringIO(tsv_text, newline = ""), delimiter = "\t"))
+
+        checks = (
+            ("text", [values for _, values in iter_tsv_rows(tsv_text)], [row for row in reference_rows if row]),
+            ("lines", [values for _, values in iter_tsv_rows(io.StringIO(tsv_text, newline = ""))], [row for row in reference_rows if row]),
+            ("empty lines kept", [values for _, values in iter_tsv_rows(tsv_text, keep_empty_lines = True)], [row or [""] for row in reference_rows])
+        )
+
+        for check_name, rows, expected_rows in checks:
+            if rows != expected_rows:
+                return ["case %s (%s): %r gives %r, expected %r" % (case_counter, check_name, tsv_text, rows, expected_rows)]
+
+    return []
+
+
+def check_quest(rng: random.Random, row_amount: int, unspaced: bool, executor: ProcessPoolExecutor | None) -> list[str]:
+    headers, texts = generate_quest_sheet(rng, row_amount, unspaced)
+
+    classified_dialogue, variable_text = classify_dialogue(headers, texts)
+    translations = {og_text: "%s (translated)" % og_text for og_text in variable_text[::2]}
+
+    translated_dialogue = replace_variable_text(classified_dialogue, translations)
+
+    dialogue_cache = DialogueCache()
+    errors = []
+
+    for compact in (False, True):
+        expected_html = format_dialogue(translated_dialogue, compact = compact)
+
+        if "".join(render_segments(get_segments(translated_dialogue), compact)) != expected_html:
+            errors.append("segments differ from sequential rendering (compact %s)" % compact)
+
+        if dialogue_cache.format_dialogue(classified_dialogue, translations, compact = compact) != expected_html:
+            errors.append("cached rendering differs from sequential rendering (compact %s)" % compact)
+
+        if executor is not None and len(translated_dialogue) >= 2 * PARALLEL_CHUNK_ROWS:
+            if format_dialogue_parallel(translated_dialogue, executor, compact = compact) != expected_html:
+                errors.append("parallel rendering differs from sequential rendering (compact %s)" % compact)
+
+    # A few edits of dialogue lines (edited, added, removed), rendered again from the cache of the first dialogue
+    dialogue_rows_idx = [row_idx for row_idx, row_type in enumerate(classified_dialogue.row_types) if row_type == "dialogue"]
+
+    for row_idx in sorted(rng.sample(dialogue_rows_idx, min(6, len(dialogue_rows_idx))), reverse = True):
+        match rng.randrange(3):
+            case 0:
+                texts[row_idx] = "%s edited" % texts[row_idx]
+            case 1:
+                headers.insert(row_idx, headers[row_idx])
+                texts.insert(row_idx, "%s added" % texts[row_idx])
+            case 2:
+                if row_idx > 0 and row_idx - 1 in dialogue_rows_idx:
+                    del headers[row_idx]
+                    del texts[row_idx]
+
+    edited_dialogue, _ = dialogue_cache.classify_dialogue(headers, texts)
+    expected_dialogue, _ = classify_dialogue(headers, texts)
+
+    if (edited_dialogue.type_codes, edited_dialogue.headers, edited_dialogue.texts) != (expected_dialogue.type_codes, expected_dialogue.headers, expected_dialogue.texts):
+        errors.append("cached classification differs after edits")
+
+    if dialogue_cache.format_dialogue(edited_dialogue, translations) != format_dialogue(replace_variable_text(expected_dialogue, translations)):
+        errors.append("cached rendering differs after edits")
+
+    return errors
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(
+        description = "Checks the hand-written parts of both tools against their reference implementation: the stamped PGC spreadsheet "
+                      "against openpyxl, the TSV parser against the csv module, and the segmented, cached and parallel dialogue rendering "
+                      "against sequential rendering. Exits with 1 if any output differs."
+    )
+    parser.add_argument("--seed", type = int, default = 0, help = "seed of the generated data")
+    parser.add_argument("--workers", type = int, default = 2, help = "worker processes of the parallel rendering check, 0 to skip it")
+    parser.add_argument("--quick", action = "store_true", help = "skip the largest dialogues")
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+
+    executor = ProcessPoolExecutor(args.workers, mp_context = multiprocessing.get_context("spawn")) if args.workers else None
+
+    quest_cases = [(row_amount, unspaced) for row_amount in (50, 2000, 2 * PARALLEL_CHUNK_ROWS + 500) for unspaced in (False, True)]
+
+    if args.quick:
+        quest_cases = quest_cases[:4]
+
+    checks = [("tsv/2000 cases", lambda: check_tsv(rng, 2000))]
+    checks += [("pgc/%s languages/%s objects" % (language_amount, object_amount), lambda language_amount = language_amount, object_amount = object_amount: check_pgc(rng, language_amount, object_amount)) for language_amount in (13, 15) for object_amount in (1, 20)]
+    checks += [("quest/%s %s rows" % (row_amount, "unspaced" if unspaced else "spaced"), lambda row_amount = row_amount, unspaced = unspaced: check_quest(rng, row_amount, unspaced, executor)) for row_amount, unspaced in quest_cases]
+
+    failed_amount = 0
+
+    try:
+        for check_name, check in checks:
+            errors = check()
+
+            print("%-30s %s" % (check_name, "FAILED" if errors else "ok"))
+
+            for error in errors:
+                print("    %s" % error)
+
+            failed_amount += bool(errors)
+    finally:
+        if executor is not None:
+            executor.shutdown()
+
+    print("%s/%s checks passed" % (len(checks) - failed_amount, len(checks)))
+
+    return 1 if failed_amount else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
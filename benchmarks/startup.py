@@ -0,0 +1,138 @@
+import argparse
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PAGES = ("app.py", "pages/home.py", "pages/pgc_creator.py", "pages/quest_formatter.py", "pages/about.py")
+
+# Modules that are slow to import, reported when a page loads them
+HEAVY_MODULES = ("pandas", "numpy", "pyarrow", "openpyxl", "sqlite3")
+
+
+def get_peak_memory_mb() -> float:
+    # Linux gives the peak resident size in kilobytes, macOS in bytes
+    peak_memory = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return round(peak_memory / (1024 * 1024 if sys.platform == "darwin" else 1024), 3)
+
+
+# Runs in a fresh interpreter: imports Streamlit, runs the page once as a new session would, then reruns it
+def run_page(page_path: str, rerun_amount: int) -> dict:
+    start_time = time.perf_counter()
+
+    import streamlit
+    from streamlit.testing.v1 import AppTest
+
+    results = {"import_streamlit": {"seconds": round(time.perf_counter() - start_time, 6), "peak_memory_mb": get_peak_memory_mb()}}
+
+    preloaded_modules = set(sys.modules)
+
+    app_test = AppTest.from_file(os.path.join(REPO_DIR, page_path), default_timeout = 120)
+
+    start_time = time.perf_counter()
+    app_test.run()
+
+    results["first_run"] = {"seconds": round(time.perf_counter() - start_time, 6), "peak_memory_mb": get_peak_memory_mb()}
+
+    if app_test.exception:
+        raise RuntimeError("%s raised %s" % (page_path, app_test.exception[0].value))
+
+    rerun_times = []
+
+    for _ in range(rerun_amount):
+        start_time = time.perf_counter()
+        app_test.run()
+        rerun_times.append(time.perf_counter() - start_time)
+
+    results["rerun"] = {"seconds": round(statistics.median(rerun_times), 6), "peak_memory_mb": get_peak_memory_mb()}
+
+    return {
+        "results": results,
+        "modules": [module_name for module_name in HEAVY_MODULES if module_name in sys.modules and module_name not in preloaded_modules]
+    }
+
+
+def benchmark_page(page_path: str, rerun_amount: int) -> dict:
+    start_time = time.perf_counter()
+
+    page_run = subprocess.run(
+        [sys.executable, os.path.abspath(__file__), "--page", page_path, "--reruns", str(rerun_amount)],
+        cwd = REPO_DIR,
+        capture_output = True,
+        text = True,
+        check = True
+    )
+
+    page_results = json.loads(page_run.stdout.splitlines()[-1])
+
+    # The whole cold start, with the interpreter startup and exit
+    page_results["results"]["process"] = {"seconds": round(time.perf_counter() - start_time, 6), "peak_memory_mb": page_results["results"]["first_run"]["peak_memory_mb"]}
+
+    return page_results
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description = "Measures the cold start and the rerun time of each page, each in a fresh interpreter, and compares them with a baseline.")
+    parser.add_argument("--save", metavar = "PATH", help = "write the results to a JSON baseline")
+    parser.add_argument("--compare", metavar = "PATH", help = "compare the results with a JSON baseline, exits with 1 on regressions")
+    parser.add_argument("--threshold", type = float, default = 0.2, help = "slowdown flagged as a regression (defaults to 0.2, i.e. 20%%)")
+    parser.add_argument("--memory-threshold", type = float, default = 0.2, help = "peak memory increase flagged as a regression (defaults to 0.2)")
+    parser.add_argument("--reruns", type = int, default = 10, help = "number of timed reruns of each page, the median is kept")
+    parser.add_argument("--page", help = argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    # Inside the fresh interpreter of one page
+    if args.page:
+        sys.path.insert(0, REPO_DIR)
+
+        print(json.dumps(run_page(args.page, args.reruns)))
+
+        return 0
+
+    from pipeline import compare_results, print_results
+
+    run = {
+        "machine": {"python": platform.python_version(), "platform": platform.platform(), "cpus": os.cpu_count()},
+        "reruns": args.reruns,
+        "results": {},
+        "modules": {}
+    }
+
+    for page_path in PAGES:
+        print("Running %s..." % page_path, file = sys.stderr)
+
+        page_results = benchmark_page(page_path, args.reruns)
+
+        run["results"][page_path] = page_results["results"]
+        run["modules"][page_path] = page_results["modules"]
+
+    if args.save:
+        with open(args.save, "w", encoding = "utf-8") as baseline_file:
+            json.dump(run, baseline_file, indent = 2)
+
+    for page_path, module_names in run["modules"].items():
+        print("%-30s loads %s" % (page_path, ", ".join(module_names) or "no heavy module"))
+
+    if not args.compare:
+        print_results(run)
+        return 0
+
+    with open(args.compare, encoding = "utf-8") as baseline_file:
+        baseline = json.load(baseline_file)
+
+    regression_amount = compare_results(run, baseline, args.threshold, args.memory_threshold)
+
+    print("%s regression(s)" % regression_amount)
+
+    return 1 if regression_amount else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
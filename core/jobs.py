@@ -0,0 +1,117 @@
+import contextvars
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable
+from concurrent.futures import ThreadPoolExecutor
+
+
+class JobCancelled(Exception):
+    pass
+
+
+class Job:
+    # A long task run in the background. The task reports its progress (e.g. sheets written out of the total) through
+    # report_progress, which is also where it stops when the job is cancelled.
+    def __init__(self, description: str) -> None:
+        self.id = uuid.uuid4().hex
+        self.description = description
+        self.status = "queued"
+        self.done = 0
+        self.total = 0
+        self.result = None
+        self.error = None
+        self.finished_at = None
+        self.future = None
+        self.cancel_event = threading.Event()
+
+    def report_progress(self, done: int, total: int) -> None:
+        if self.cancel_event.is_set():
+            raise JobCancelled()
+
+        self.done = done
+        self.total = total
+
+    @property
+    def progress(self) -> float:
+        return self.done / self.total if self.total else 0.0
+
+    @property
+    def finished(self) -> bool:
+        return self.status in ("done", "failed", "cancelled")
+
+
+class JobManager:
+    # Runs the jobs of every session on a bounded pool of threads. Finished jobs are kept for `ttl` seconds
+    # (at most `max_finished_jobs` of them), so that a page reloaded in the meantime can still get their result.
+    def __init__(self, max_workers: int = 4, max_finished_jobs: int = 64, ttl: float = 3600) -> None:
+        self.executor = ThreadPoolExecutor(max_workers, thread_name_prefix = "hoyowiki-tools-job")
+        self.jobs = OrderedDict()
+        self.max_finished_jobs = max_finished_jobs
+        self.ttl = ttl
+        self.lock = threading.Lock()
+
+    # The task is called with the given arguments and a `progress` callback, its return value is the result of the job
+    def submit(self, description: str, task: Callable, *args, **kwargs) -> Job:
+        job = Job(description)
+
+        with self.lock:
+            self.evict_finished_jobs()
+            self.jobs[job.id] = job
+
+        # The task runs in the context of the caller, so that it is timed as part of the caller's run
+        job.future = self.executor.submit(contextvars.copy_context().run, self.run, job, task, args, kwargs)
+
+        return job
+
+    def run(self, job: Job, task: Callable, args: tuple, kwargs: dict) -> None:
+        if job.cancel_event.is_set():
+            job.status = "cancelled"
+        else:
+            job.status = "running"
+
+            try:
+                job.result = task(*args, progress = job.report_progress, **kwargs)
+            except JobCancelled:
+                job.status = "cancelled"
+            except Exception as error:
+                job.error = error
+                job.status = "failed"
+            else:
+                job.status = "done"
+
+        job.finished_at = time.time()
+
+    def get(self, job_id: str) -> Job | None:
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def cancel(self, job_id: str) -> None:
+        job = self.get(job_id)
+
+        if job is not None and not job.finished:
+            job.cancel_event.set()
+
+    def evict_finished_jobs(self) -> None:
+        finished_jobs = [job for job in self.jobs.values() if job.finished]
+        expired_time = time.time() - self.ttl
+
+        for job_counter, job in enumerate(finished_jobs):
+            if job.finished_at < expired_time or job_counter < len(finished_jobs) - self.max_finished_jobs:
+                del self.jobs[job.id]
+
+
+default_job_manager = None
+default_job_manager_lock = threading.Lock()
+
+
+# The job manager shared by every page and session of the server
+def get_job_manager() -> JobManager:
+    global default_job_manager
+
+    with default_job_manager_lock:
+        if default_job_manager is None:
+            default_job_manager = JobManager()
+
+    return default_job_manager
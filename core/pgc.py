@@ -0,0 +1,255 @@
+from __future__ import annotations
+
+import os
+from collections.abc import Callable, Iterable, Iterator
+from typing import TYPE_CHECKING, TextIO
+
+from core.timing import stage, timed_run
+from core.tsv import iter_tsv_rows
+from core.xlsx import CellRange, CompiledSheet, SharedStrings, StampedWorkbookWriter, cell_to_text, iter_sheet_rows, read_first_sheet_text
+
+# pandas is imported by the functions that need it, so that importing the module stays cheap until a template is read
+if TYPE_CHECKING:
+    import pandas as pd
+
+
+# Only the first sheet of a template is used, it is read straight from the file without loading the rest of the workbook
+def read_template(template_xlsx) -> pd.DataFrame:
+    import pandas as pd
+
+    with stage("read_template") as read_stage:
+        template_df = pd.DataFrame(read_first_sheet_text(template_xlsx), dtype = object)
+
+        read_stage.counts["rows"] = len(template_df)
+
+    return template_df
+
+
+class TemplateAnalysis:
+    # Everything the batch needs to know about a template, computed once with column-wide operations
+    def __init__(self, template_df: pd.DataFrame) -> None:
+        import numpy as np
+        import pandas as pd
+
+        # Templates with 13 languages (Honkai Star Rail, Zenless Zone Zero) stop before column 17
+        self.language_amount = 15 if template_df.shape[1] > 17 and template_df.iat[0, 17] != "" else 13
+
+        ids = template_df.iloc[:, 0]
+        id_mask = (ids != "").to_numpy()
+
+        # Rows with an identifier but no text are the ones to fill in
+        target_mask = id_mask & (template_df.iloc[:, 3] == "").to_numpy()
+        self.target_rows_idx = np.flatnonzero(target_mask).tolist()
+
+        target_rows_df = template_df.iloc[self.target_rows_idx, :3].astype(str)
+        self.target_rows_header = (
+            target_rows_df.iloc[:, 0] + " " + target_rows_df.iloc[:, 1] + " " + target_rows_df.iloc[:, 2]
+            + " (R" + pd.Series(self.target_rows_idx, index = target_rows_df.index, dtype = str) + ")"
+        ).tolist()
+
+        # The first row holds the languages, the identifiers of the others are written as numbers
+        id_mask[:1] = False
+        self.id_rows_idx = np.flatnonzero(id_mask)
+        try:
+            self.ids = ids.iloc[self.id_rows_idx].astype(int).to_numpy().astype(object)
+        except ValueError as error:
+            raise ValueError("The identifiers of the template (first column) must be numbers, %s" % error) from None
+
+    def cast_ids(self, template_df: pd.DataFrame) -> None:
+        template_df.iloc[self.id_rows_idx, 0] = self.ids
+
+    def get_target_rows(self) -> dict:
+        return {
+            "idx": list(self.target_rows_idx),
+            "header": list(self.target_rows_header),
+            "tsv_text": [],
+            "language_amount": self.language_amount
+        }
+
+
+# Note: the identifiers of the template rows are cast to integers in place
+def get_target_rows(template_df: pd.DataFrame, template_analysis: TemplateAnalysis | None = None) -> dict:
+    with stage("get_target_rows", rows = len(template_df)) as target_stage:
+        if template_analysis is None:
+            template_analysis = TemplateAnalysis(template_df)
+
+        template_analysis.cast_ids(template_df)
+
+        target_rows = template_analysis.get_target_rows()
+
+        target_stage.counts["target_rows"] = len(target_rows["idx"])
+
+    return target_rows
+
+
+# Reads the batch text of a target row, checking that each object has one value (a link) or one value per language
+def iter_batch_objects(batch_text: Iterable[str] | str, row_idx: int, language_amount: int) -> Iterator[list[str]]:
+    try:
+        for line_number, object_line in iter_tsv_rows(batch_text):
+            if len(object_line) not in (1, language_amount):
+                raise ValueError("line %s: %s values, expected 1 or %s" % (line_number, len(object_line), language_amount))
+
+            yield object_line
+    except ValueError as error:
+        raise ValueError("Row R%s, %s" % (row_idx, error)) from None
+
+
+# Reads and checks the batch text of every target row before anything is written, so that malformed text fails early
+def read_batch_text(target_rows: dict, batch_texts: Iterable[Iterable[str] | str]) -> None:
+    target_rows_tsv = []
+
+    with stage("read_batch_text", target_rows = len(target_rows["idx"])) as read_stage:
+        for row_idx, batch_text in zip(target_rows["idx"], batch_texts):
+            target_rows_tsv.append(list(iter_batch_objects(batch_text, row_idx, target_rows["language_amount"])))
+
+            check_object_amounts(target_rows["idx"], target_rows_tsv)
+
+        read_stage.counts["objects"] = len(target_rows_tsv[0]) if target_rows_tsv else 0
+
+    target_rows["tsv_text"] = target_rows_tsv
+
+
+def check_object_amounts(target_rows_idx: list[int], target_rows_tsv: list[list[list[str]]]) -> None:
+    for row_idx, tsv_text in zip(target_rows_idx, target_rows_tsv):
+        if len(tsv_text) == 0:
+            raise ValueError("Row R%s has no text" % row_idx)
+
+        if len(tsv_text) != len(target_rows_tsv[0]):
+            raise ValueError("Row R%s has %s objects, but row R%s has %s" % (row_idx, len(tsv_text), target_rows_idx[0], len(target_rows_tsv[0])))
+
+
+# Reads the batch text of every target row from a cell range of a workbook: one object per row of the range,
+# one column per language (or a single column of links). Each sheet is read once, row by row, for all the ranges it holds.
+def read_batch_workbook(target_rows: dict, source_xlsx, batch_ranges: list[str]) -> None:
+    language_amount = target_rows["language_amount"]
+
+    cell_ranges = []
+
+    for row_idx, batch_range in zip(target_rows["idx"], batch_ranges):
+        try:
+            cell_range = CellRange(batch_range)
+        except ValueError as error:
+            raise ValueError("Row R%s, %s" % (row_idx, error)) from None
+
+        if cell_range.width not in (1, language_amount):
+            raise ValueError("Row R%s, %s is %s columns wide, expected 1 or %s" % (row_idx, batch_range, cell_range.width, language_amount))
+
+        cell_ranges.append(cell_range)
+
+    target_rows_tsv = [[] for _ in cell_ranges]
+
+    with stage("read_batch_workbook", target_rows = len(cell_ranges)) as read_stage:
+        for sheet_name in dict.fromkeys(cell_range.sheet_name for cell_range in cell_ranges):
+            sheet_ranges = [(tsv_text, cell_range) for tsv_text, cell_range in zip(target_rows_tsv, cell_ranges) if cell_range.sheet_name == sheet_name]
+
+            last_rows = [cell_range.last_row for _, cell_range in sheet_ranges]
+            last_row = None if None in last_rows else max(last_rows)
+
+            for row_number, row in iter_sheet_rows(source_xlsx, sheet_name):
+                # Stop reading once every range of the sheet is complete
+                if last_row is not None and row_number > last_row:
+                    break
+
+                for tsv_text, cell_range in sheet_ranges:
+                    if row_number in cell_range:
+                        object_line = [cell_to_text(value) for value in cell_range.get_values(row)]
+
+                        # Empty lines are skipped, like in pasted text
+                        if any(object_line):
+                            tsv_text.append(object_line)
+
+        read_stage.counts["objects"] = len(target_rows_tsv[0]) if target_rows_tsv else 0
+
+    check_object_amounts(target_rows["idx"], target_rows_tsv)
+
+    target_rows["tsv_text"] = target_rows_tsv
+
+
+# `progress` is called with the number of sheets written and the total after each sheet
+def create_batch_sheet(template_df: pd.DataFrame, target_rows: dict, batch_file, progress: Callable[[int, int], None] | None = None) -> None:
+    target_rows_idx = target_rows["idx"]
+    target_rows_tsv = target_rows["tsv_text"]
+    language_amount = target_rows["language_amount"]
+
+    object_amount = len(target_rows_tsv[0])
+
+    # Serialize the template once, each sheet only needs its target cells to be stamped in
+    with stage("compile_template", rows = len(template_df)):
+        shared_strings = SharedStrings()
+        template_rows = template_df.values.tolist()
+        compiled_sheet = CompiledSheet(template_rows, dict.fromkeys(target_rows_idx, 3), language_amount, shared_strings)
+
+    if progress is not None:
+        progress(0, object_amount)
+
+    with stage("write_sheets", sheets = object_amount), StampedWorkbookWriter(batch_file, shared_strings) as writer:
+        for processed_df_counter in range(object_amount):
+            object_lines = {}
+
+            # For each target row
+            for row_counter in range(len(target_rows_idx)):
+                object_line = target_rows_tsv[row_counter][processed_df_counter]
+
+                # If the object line only has one object (i.e. language), consider it a link
+                if len(object_line) == 1:
+                    link = object_line[0]
+
+                    # Duplicate the link of the line of content to have one per language
+                    for _ in range(language_amount - 1):
+                        object_line.append(link)
+
+                if len(object_line) != language_amount:
+                    raise ValueError("Object %s of row R%s has %s values, expected 1 or %s" % (processed_df_counter, target_rows_idx[row_counter], len(object_line), language_amount))
+
+                object_lines[target_rows_idx[row_counter]] = object_line
+
+            # Add the stamped template to the batch file
+            sheet_name = "Sheet%s" % processed_df_counter
+
+            writer.add_sheet(sheet_name, compiled_sheet.stamp(object_lines))
+
+            if progress is not None:
+                progress(processed_df_counter + 1, object_amount)
+
+
+def get_batch_text_path(batch_dir: str, template_name: str, row_idx: int) -> str:
+    return os.path.join(batch_dir, "%s.R%s.tsv" % (template_name, row_idx))
+
+
+# Opens the batch text files one after the other, each one is read line by line
+def iter_batch_text_files(batch_dir: str, template_path: str, target_rows_idx: list[int]) -> Iterator[TextIO]:
+    template_name = os.path.splitext(os.path.basename(template_path))[0]
+
+    for idx in target_rows_idx:
+        batch_text_path = get_batch_text_path(batch_dir, template_name, idx)
+
+        if not os.path.isfile(batch_text_path):
+            raise FileNotFoundError("Missing batch text for row R%s of %s: %s" % (idx, template_path, batch_text_path))
+
+        with open(batch_text_path, encoding = "utf-8", newline = "") as batch_text_file:
+            yield batch_text_file
+
+
+# Builds the PGC spreadsheet of one template, reading the batch text of each target row from `<template name>.R<row>.tsv`
+def create_batch_file(template_path: str, batch_dir: str, output_dir: str) -> str:
+    template_name = os.path.splitext(os.path.basename(template_path))[0]
+
+    # Each template is timed as its own run
+    with timed_run("PGC batch %s" % template_name):
+        template_df = read_template(template_path)
+        target_rows = get_target_rows(template_df)
+
+        read_batch_text(target_rows, iter_batch_text_files(batch_dir, template_path, target_rows["idx"]))
+
+        output_path = os.path.join(output_dir, "PGC_BATCH_OUT_%s.xlsx" % template_name)
+
+        with open(output_path, "wb") as batch_file:
+            try:
+                create_batch_sheet(template_df, target_rows, batch_file)
+            except Exception:
+                # Do not leave a truncated spreadsheet behind
+                batch_file.close()
+                os.remove(output_path)
+                raise
+
+    return output_path
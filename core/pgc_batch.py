@@ -0,0 +1,67 @@
+import argparse
+import glob
+import os
+import sys
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+from core.pgc import create_batch_file
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog = "python -m core.pgc_batch",
+        description = "Creates a PGC spreadsheet for every template of a directory. "
+                      "The batch text of row R<n> of `<name>.xlsx` is read from `<name>.R<n>.tsv`."
+    )
+
+    parser.add_argument("template_dir", help = "directory containing the template .xlsx files")
+    parser.add_argument("--batch-dir", help = "directory containing the .tsv batch text files (defaults to the template directory)")
+    parser.add_argument("--output-dir", default = ".", help = "directory where the PGC spreadsheets are written (defaults to the current directory)")
+    parser.add_argument("--jobs", type = int, default = None, help = "number of worker processes (defaults to the number of CPUs)")
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    batch_dir = args.batch_dir or args.template_dir
+
+    # Skip the lock files Excel leaves next to opened workbooks
+    template_paths = sorted(
+        template_path for template_path in glob.glob(os.path.join(args.template_dir, "*.xlsx"))
+        if not os.path.basename(template_path).startswith("~$")
+    )
+
+    if not template_paths:
+        print("No template found in %s" % args.template_dir, file = sys.stderr)
+        return 1
+
+    os.makedirs(args.output_dir, exist_ok = True)
+
+    failed_amount = 0
+
+    with ProcessPoolExecutor(max_workers = args.jobs) as executor:
+        futures = {
+            executor.submit(create_batch_file, template_path, batch_dir, args.output_dir): template_path
+            for template_path in template_paths
+        }
+
+        for future in as_completed(futures):
+            template_path = futures[future]
+
+            try:
+                output_path = future.result()
+            except Exception as error:
+                failed_amount += 1
+                print("FAILED %s: %s" % (template_path, error), file = sys.stderr)
+            else:
+                print("%s -> %s" % (template_path, output_path))
+
+    print("%s/%s PGC spreadsheets created" % (len(template_paths) - failed_amount, len(template_paths)))
+
+    return 1 if failed_amount else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,683 @@
+import hashlib
+import html
+import json
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Executor
+
+from core.timing import stage
+
+
+ROW_TYPES = ("description", "objective", "missing", "addopt", "choice_flag", "choice_branch", "location", "dialogue", "sub_mission", "action", "blank")
+
+ADDOPT_RE = re.compile("Additional|Alternative|Optional")
+CHOICE_BRANCH_RE = re.compile(r"\d+\.\s+")
+CHOICE_SPEAKER_RE = re.compile(r"(?:\d+\.\s+)+(.+)")
+
+# Inline markup, read in a single scan: rubies (with the text they annotate and the spaces around them),
+# non-breaking spaces and groups of placeholders.
+# A ruby can only start where a word starts, otherwise unspaced (Chinese, Japanese, Thai) lines would be read again from every character.
+MARKUP_RE = re.compile(
+    r"(?P<ruby>\s*(?<![^\s{}])(?P<base_start>[^\s{}]+)\{RUBY#\[.\](?P<ruby_text>[^{}]+)\}(?P<base_end>[^\s{}]+)\s*)"
+    r"|(?P<non_break_space>\{NON_BREAK_SPACE\})"
+    r"|(?P<variable>(?:\{(?!NON_BREAK_SPACE\})[^{}]+\})+)"
+)
+
+# Classification rules, in order of priority: the first rule that matches a row gives its type.
+# The rules that only read the header come first, so that a header column can be classified once for every language.
+HEADER_ROW_TYPE_RULES = (
+    ("description", lambda header: "Desc" in header),
+    ("objective", lambda header: "Objective" in header or header.isdigit()),
+    ("missing", lambda header: "Missing" in header),
+    ("addopt", lambda header: ADDOPT_RE.search(header) is not None),
+    ("choice_flag", lambda header: header == "Choice"),
+    ("choice_branch", lambda header: CHOICE_BRANCH_RE.search(header) is not None),
+    ("location", lambda header: "," in header)
+)
+
+TEXT_ROW_TYPE_RULES = (
+    ("dialogue", lambda header, text: header != "" and text != ""),
+    ("sub_mission", lambda header, text: header != ""),
+    ("action", lambda header, text: text != "")
+)
+
+# Row types are stored as their index in ROW_TYPES
+ROW_TYPE_CODES = {row_type: row_type_code for row_type_code, row_type in enumerate(ROW_TYPES)}
+
+# Code of the rows whose type depends on their text
+TEXT_ROW_TYPE_CODE = -1
+
+# Rows whose header is replaced by a fixed one
+ROW_TYPE_HEADERS = {"description": "Quest Description", "objective": "Quest Objective"}
+
+# Rows whose header needs to be translated
+VARIABLE_HEADER_ROW_TYPES = ("description", "objective", "addopt", "location", "dialogue", "sub_mission")
+
+FIXED_HEADERS = {ROW_TYPE_CODES[row_type]: fixed_header for row_type, fixed_header in ROW_TYPE_HEADERS.items()}
+VARIABLE_HEADER_ROW_TYPE_CODES = frozenset(ROW_TYPE_CODES[row_type] for row_type in VARIABLE_HEADER_ROW_TYPES)
+
+# Block templates of the dialogue HTML, kept with the indentation they always had so that the output does not change
+DESCRIPTION_BLOCK = """
+                <table>
+                    <tbody>
+                        <tr>
+                            <td colspan="1" rowspan="1">
+                                <p>
+                                    <strong><span style="color: rgb(255, 255, 255);">%s: </span></strong>
+                                    <span style="color: rgb(255, 255, 255);">%s</span>
+                                </p>
+                            </td>
+                        </tr>
+                    </tbody>
+                </table>
+                """
+
+OBJECTIVE_BLOCK = """
+                <table>
+                    <tbody>
+                        <tr>
+                            <td colspan="1" rowspan="1">
+                                <p><strong>%s: </strong>%s</p>
+                            </td>
+                        </tr>
+                    </tbody>
+                </table>
+                """
+
+ADDOPT_OPEN_BLOCK = """
+                <p>%s</p>
+                <table>
+                    <tbody>
+                        <tr>
+                            <td colspan="1" rowspan="1">
+                """
+
+CHOICE_BRANCH_OPEN_BLOCK = """
+                <table>
+                    <tbody>
+                        <tr>
+                            <td colspan="1" rowspan="1">
+                                <p><span style="color: rgb(255, 255, 255);">%s: %s</span></p>
+                """
+
+LOCATION_BLOCK = """
+                <p>
+                    <strong><span style="color: rgb(236, 229, 216);">%s</span></strong>
+                </p>
+                """
+
+ACTION_BLOCK = """
+                <p></p>
+                <table>
+                    <tbody>
+                        <tr>
+                            <td colspan="1" rowspan="1">
+                                <p><span style="color: rgb(255, 255, 255);">%s</span></p>
+                            </td>
+                        </tr>
+                    </tbody>
+                </table>
+                <p></p>
+                """
+
+TABLE_CLOSE_BLOCK = """
+                                </td>
+                            </tr>
+                        </tbody>
+                    </table>
+                    """
+
+BLANK_TABLE_CLOSE_BLOCK = """
+                                        </td>
+                                    </tr>
+                                </tbody>
+                            </table>
+                            """
+
+DIALOGUE_LINE = """<p><span style="color: rgb(255, 255, 255);">%s: </span>%s</p>"""
+SUB_MISSION_LINE = "<p><em>%s</em></p>"
+EMPTY_PARAGRAPH = "<p></p>"
+
+BLOCKS = {
+    "description": DESCRIPTION_BLOCK,
+    "objective": OBJECTIVE_BLOCK,
+    "addopt_open": ADDOPT_OPEN_BLOCK,
+    "choice_branch_open": CHOICE_BRANCH_OPEN_BLOCK,
+    "location": LOCATION_BLOCK,
+    "action": ACTION_BLOCK,
+    "table_close": TABLE_CLOSE_BLOCK,
+    "blank_table_close": BLANK_TABLE_CLOSE_BLOCK,
+    "dialogue": DIALOGUE_LINE,
+    "sub_mission": SUB_MISSION_LINE,
+    "empty_paragraph": EMPTY_PARAGRAPH
+}
+
+# Same blocks without indentation, default attributes or repeated styles, for a smaller payload that renders the same
+COMPACT_BLOCKS = {
+    "description": """<table><tbody><tr><td><p><span style="color:#fff"><strong>%s: </strong>%s</span></p></td></tr></tbody></table>""",
+    "objective": """<table><tbody><tr><td><p><strong>%s: </strong>%s</p></td></tr></tbody></table>""",
+    "addopt_open": """<p>%s</p><table><tbody><tr><td>""",
+    "choice_branch_open": """<table><tbody><tr><td><p><span style="color:#fff">%s: %s</span></p>""",
+    "location": """<p><strong><span style="color:#ece5d8">%s</span></strong></p>""",
+    "action": """<p></p><table><tbody><tr><td><p><span style="color:#fff">%s</span></p></td></tr></tbody></table><p></p>""",
+    "table_close": """</td></tr></tbody></table>""",
+    "blank_table_close": """</td></tr></tbody></table>""",
+    "dialogue": """<p><span style="color:#fff">%s: </span>%s</p>""",
+    "sub_mission": "<p><em>%s</em></p>",
+    "empty_paragraph": "<p></p>"
+}
+
+# Rows sent to a worker at once when rendering in parallel, smaller dialogues are rendered sequentially
+PARALLEL_CHUNK_ROWS = 5000
+
+
+def trie_to_pattern(trie: dict) -> str:
+    # The end of a text ("") is tried last, so that longer texts sharing the same beginning are matched first
+    branches = []
+
+    for char, child_trie in trie.items():
+        if char == "":
+            continue
+
+        # Follow the characters that have no alternative without recursing
+        chars = [char]
+
+        while len(child_trie) == 1 and "" not in child_trie:
+            (char, child_trie), = child_trie.items()
+            chars.append(char)
+
+        branches.append(re.escape("".join(chars)) + trie_to_pattern(child_trie))
+
+    if "" in trie:
+        branches.append("")
+
+    if len(branches) == 1:
+        return branches[0]
+
+    return "(?:%s)" % "|".join(branches)
+
+
+class TextReplacer:
+    # Applies every replacement to a text, the longest original texts first: where two original texts overlap, the longest one is replaced.
+    # Replaced text is never searched again, so that a translation is inserted as it was given.
+    # The original texts are merged into a prefix tree, so that each position only tests the texts that can still match, and most texts
+    # are replaced in a single scan.
+    def __init__(self, replacements: dict[str, str]) -> None:
+        self.replacements = {og_text: new_text for og_text, new_text in replacements.items() if og_text and og_text != new_text}
+
+        # Texts of the same length are ordered alphabetically, so that the order of the translations does not matter
+        self.longest_first_texts = sorted(self.replacements, key = lambda og_text: (-len(og_text), og_text))
+
+        if self.replacements:
+            trie = {}
+
+            for og_text in self.replacements:
+                node = trie
+
+                for char in og_text:
+                    node = node.setdefault(char, {})
+
+                node[""] = {}
+
+            self.pattern = re.compile(trie_to_pattern(trie))
+        else:
+            self.pattern = None
+
+    def replace(self, text: str) -> str:
+        if self.pattern is None:
+            return text
+
+        matches = list(self.pattern.finditer(text))
+
+        if not matches:
+            return text
+
+        # The single scan replaces the longest text at each position from the left. It gives the same result unless an original text
+        # starting inside a match goes past its end.
+        for match in matches:
+            for position in range(match.start() + 1, match.end()):
+                inner_match = self.pattern.match(text, position)
+
+                if inner_match is not None and inner_match.end() > match.end():
+                    return self.replace_longest_first(text)
+
+        return self.join_replacements(text, [match.span() for match in matches])
+
+    def replace_longest_first(self, text: str) -> str:
+        replaced_spans = []
+
+        for og_text in self.longest_first_texts:
+            position = text.find(og_text)
+
+            while position != -1:
+                end = position + len(og_text)
+
+                if any(position < replaced_end and replaced_start < end for replaced_start, replaced_end in replaced_spans):
+                    position = text.find(og_text, position + 1)
+                else:
+                    replaced_spans.append((position, end))
+                    position = text.find(og_text, end)
+
+        return self.join_replacements(text, sorted(replaced_spans))
+
+    def join_replacements(self, text: str, spans: list[tuple[int, int]]) -> str:
+        parts = []
+        last_end = 0
+
+        for start, end in spans:
+            parts.append(text[last_end:start])
+            parts.append(self.replacements[text[start:end]])
+            last_end = end
+
+        parts.append(text[last_end:])
+
+        return "".join(parts)
+
+
+class ClassifiedDialogue:
+    # The rows of a classified dialogue as parallel sequences: the type code of each row (one byte), its header and its text
+    __slots__ = ("type_codes", "headers", "texts")
+
+    def __init__(self, type_codes: bytes, headers: list[str], texts: list[str]) -> None:
+        self.type_codes = type_codes
+        self.headers = headers
+        self.texts = texts
+
+    def __len__(self) -> int:
+        return len(self.type_codes)
+
+    @property
+    def row_types(self) -> list[str]:
+        return [ROW_TYPES[row_type_code] for row_type_code in self.type_codes]
+
+
+def replace_variable_text(classified_dialogue: ClassifiedDialogue, translations: dict[str, str]) -> ClassifiedDialogue:
+    text_replacer = TextReplacer(translations)
+
+    return ClassifiedDialogue(
+        classified_dialogue.type_codes,
+        [text_replacer.replace(header) for header in classified_dialogue.headers],
+        [text_replacer.replace(text) for text in classified_dialogue.texts]
+    )
+
+
+def format_markup(text: str) -> tuple[str, list[str]]:
+    variable_text = []
+
+    def format_token(token: re.Match) -> str:
+        if token["ruby"] is not None:
+            base_text = html.escape(token["base_start"] + token["base_end"])
+            ruby_text = html.escape(token["ruby_text"])
+
+            return """<custom-ruby data-ruby="%s|%s"></custom-ruby>""" % (base_text, ruby_text)
+
+        if token["non_break_space"] is not None:
+            return "&nbsp;"
+
+        # Rubies that do not annotate any text are left as is
+        if r"{RUBY#" not in token["variable"]:
+            variable_text.append(token["variable"])
+
+        return token["variable"]
+
+    return MARKUP_RE.sub(format_token, text), variable_text
+
+
+# Hash of the rows as classify_dialogue reads them, used to recognize a dialogue that was already formatted
+def hash_dialogue(headers: list[str], texts: list[str]) -> str:
+    return hashlib.blake2b(json.dumps([headers, texts], ensure_ascii = False).encode(), digest_size = 16).hexdigest()
+
+
+def hash_translations(translations: dict[str, str]) -> str:
+    return hashlib.blake2b(json.dumps(sorted(translations.items()), ensure_ascii = False).encode(), digest_size = 16).hexdigest()
+
+
+def classify_header(header: str) -> int:
+    for row_type, rule in HEADER_ROW_TYPE_RULES:
+        if rule(header):
+            return ROW_TYPE_CODES[row_type]
+
+    return TEXT_ROW_TYPE_CODE
+
+
+def classify_headers(headers: list[str]) -> list[int]:
+    # Speakers come back on many rows, each header is only classified once
+    header_type_codes = {header: classify_header(header) for header in dict.fromkeys(headers)}
+
+    return [header_type_codes[header] for header in headers]
+
+
+def classify_text_row(header: str, text: str) -> int:
+    for row_type, rule in TEXT_ROW_TYPE_RULES:
+        if rule(header, text):
+            return ROW_TYPE_CODES[row_type]
+
+    return ROW_TYPE_CODES["blank"]
+
+
+def classify_rows(headers: list[str], texts: list[str], header_type_codes: list[int] | None = None) -> tuple[list[int], list[str], list[str], list[list[str]]]:
+    if header_type_codes is None:
+        header_type_codes = classify_headers(headers)
+
+    row_type_codes = []
+    classified_headers = []
+    formatted_texts = []
+    row_variable_text = []
+
+    for header, text, row_type_code in zip(headers, texts, header_type_codes):
+        if row_type_code == TEXT_ROW_TYPE_CODE:
+            row_type_code = classify_text_row(header, text)
+
+        classified_header = FIXED_HEADERS.get(row_type_code, header)
+
+        # Choice branches are translated without their numbering
+        if row_type_code == ROW_TYPE_CODES["choice_branch"]:
+            choice_speaker = CHOICE_SPEAKER_RE.search(header)
+            variable_header = choice_speaker[1] if choice_speaker is not None else None
+        elif row_type_code in VARIABLE_HEADER_ROW_TYPE_CODES:
+            variable_header = classified_header
+        else:
+            variable_header = None
+
+        formatted_text, markup_variable_text = format_markup(text) if "{" in text else (text, [])
+
+        row_type_codes.append(row_type_code)
+        classified_headers.append(classified_header)
+        formatted_texts.append(formatted_text)
+
+        # Texts to translate of the row, in the order in which they appear
+        row_variable_text.append(([variable_header] if variable_header is not None else []) + markup_variable_text)
+
+    return row_type_codes, classified_headers, formatted_texts, row_variable_text
+
+
+# Headers and texts are given as strings, empty cells as empty strings.
+# The type codes of classify_headers can be given when the same header column is classified with several text columns.
+def classify_dialogue(headers: list[str], texts: list[str], header_type_codes: list[int] | None = None) -> tuple[ClassifiedDialogue, list[str]]:
+    row_type_codes, classified_headers, formatted_texts, row_variable_text = classify_rows(headers, texts, header_type_codes)
+
+    return ClassifiedDialogue(bytes(row_type_codes), classified_headers, formatted_texts), [variable_text for variable_texts in row_variable_text for variable_text in variable_texts]
+
+
+def format_objective(headers: list[str], texts: list[str]) -> str:
+    html_parts = ["<ol>"]
+
+    for header, text in zip(headers, texts):
+        if header:
+            html_parts.append("<li><p>%s</p></li>" % text)
+
+    html_parts.append("</ol>")
+
+    return "".join(html_parts)
+
+
+def render_rows(row_types: list[str], last_row_types: list[str | None], next_row_types: list[str | None], headers: list[str], texts: list[str], blocks: dict[str, str]) -> list[str]:
+    html_parts = []
+
+    opened_tags = []
+
+    for row_type, last_row_type, next_row_type, header, text in zip(row_types, last_row_types, next_row_types, headers, texts):
+        match row_type:
+            case "description":
+                html_parts.append(blocks["description"] % (header, text))
+            case "objective":
+                html_parts.append(blocks["objective"] % (header, text))
+            case "missing":
+                continue
+            case "addopt":
+                html_parts.append(blocks["addopt_open"] % header)
+
+                opened_tags.append("addopt")
+            case "choice_flag":
+                continue
+            case "choice_branch":
+                if last_row_type != "choice_flag":
+                    html_parts.append(blocks["table_close"])
+
+                    # Close the last opened choice branch
+                    opened_tags.reverse()
+                    opened_tags.remove("choice_branch")
+                    opened_tags.reverse()
+
+                header = CHOICE_BRANCH_RE.sub("", header)
+
+                html_parts.append(blocks["choice_branch_open"] % (header, text))
+
+                opened_tags.append("choice_branch")
+            case "location":
+                html_parts.append(blocks["location"] % header)
+            case "dialogue":
+                if last_row_type == "objective":
+                    html_parts.append(blocks["empty_paragraph"])
+
+                html_parts.append(blocks["dialogue"] % (header, text))
+            case "sub_mission":
+                if last_row_type == "objective":
+                    html_parts.append(blocks["empty_paragraph"])
+
+                html_parts.append(blocks["sub_mission"] % header)
+            case "action":
+                html_parts.append(blocks["action"] % text)
+            case "blank":
+                if opened_tags and next_row_type != "choice_flag":
+                    match opened_tags[-1]:
+                        case "addopt" | "choice_branch":
+                            html_parts.append(blocks["blank_table_close"])
+
+                            opened_tags.pop()
+
+                if next_row_type != "choice_branch":
+                    html_parts.append(blocks["empty_paragraph"])
+
+    for tag in reversed(opened_tags):
+        match tag:
+            case "addopt" | "choice_branch":
+                html_parts.append(blocks["table_close"])
+
+    return html_parts
+
+
+def format_dialogue(classified_dialogue: ClassifiedDialogue, compact: bool = False) -> str:
+    blocks = COMPACT_BLOCKS if compact else BLOCKS
+
+    row_types = classified_dialogue.row_types
+
+    # Types of the rows around each row, so that no lookup is needed while rendering
+    last_row_types = [None] + row_types[:-1]
+    next_row_types = row_types[1:] + [None]
+
+    html_parts = render_rows(row_types, last_row_types, next_row_types, classified_dialogue.headers, classified_dialogue.texts, blocks)
+
+    return "".join(html_parts)
+
+
+# Splits the dialogue after the blank rows that leave no table open. Each segment then renders the same on its own,
+# as long as it is given the types of the rows just before and after it.
+def get_segment_bounds(row_types: list[str]) -> list[int]:
+    last_row_types = [None] + row_types[:-1]
+    next_row_types = row_types[1:] + [None]
+
+    segment_bounds = [0]
+
+    opened_tags = []
+
+    for row_idx, (row_type, last_row_type, next_row_type) in enumerate(zip(row_types, last_row_types, next_row_types)):
+        match row_type:
+            case "addopt":
+                opened_tags.append("addopt")
+            case "choice_branch":
+                if last_row_type != "choice_flag":
+                    opened_tags.reverse()
+                    opened_tags.remove("choice_branch")
+                    opened_tags.reverse()
+
+                opened_tags.append("choice_branch")
+            case "blank":
+                if opened_tags and next_row_type != "choice_flag":
+                    opened_tags.pop()
+
+                if not opened_tags:
+                    segment_bounds.append(row_idx + 1)
+
+    if segment_bounds[-1] != len(row_types):
+        segment_bounds.append(len(row_types))
+
+    return segment_bounds
+
+
+# Segments as (row type codes, type code of the row before, type code of the row after, headers, texts)
+def get_segments(classified_dialogue: ClassifiedDialogue) -> list[tuple]:
+    type_codes = classified_dialogue.type_codes
+    headers = classified_dialogue.headers
+    texts = classified_dialogue.texts
+
+    segment_bounds = get_segment_bounds(classified_dialogue.row_types)
+
+    return [
+        (
+            type_codes[segment_start:segment_end],
+            type_codes[segment_start - 1] if segment_start > 0 else None,
+            type_codes[segment_end] if segment_end < len(type_codes) else None,
+            tuple(headers[segment_start:segment_end]),
+            tuple(texts[segment_start:segment_end])
+        )
+        for segment_start, segment_end in zip(segment_bounds, segment_bounds[1:])
+    ]
+
+
+def render_segments(segments: list[tuple], compact: bool = False) -> list[str]:
+    blocks = COMPACT_BLOCKS if compact else BLOCKS
+
+    segments_html = []
+
+    for type_codes, last_type_code, next_type_code, headers, texts in segments:
+        row_types = [ROW_TYPES[row_type_code] for row_type_code in type_codes]
+        last_row_type = ROW_TYPES[last_type_code] if last_type_code is not None else None
+        next_row_type = ROW_TYPES[next_type_code] if next_type_code is not None else None
+
+        segments_html.append("".join(render_rows(row_types, [last_row_type] + row_types[:-1], row_types[1:] + [next_row_type], headers, texts, blocks)))
+
+    return segments_html
+
+
+# Sends the segments to the workers in chunks of about PARALLEL_CHUNK_ROWS rows, and gives their HTML back in order
+def render_segments_parallel(segments: list[tuple], compact: bool, executor: Executor) -> list[str]:
+    chunks = [[]]
+    chunk_rows = 0
+
+    for segment in segments:
+        if chunk_rows >= PARALLEL_CHUNK_ROWS:
+            chunks.append([])
+            chunk_rows = 0
+
+        chunks[-1].append(segment)
+        chunk_rows += len(segment[0])
+
+    futures = [executor.submit(render_segments, chunk, compact) for chunk in chunks]
+
+    return [segment_html for future in futures for segment_html in future.result()]
+
+
+# Renders the same HTML as format_dialogue, with the segments of the dialogue rendered by the workers of the executor
+def format_dialogue_parallel(classified_dialogue: ClassifiedDialogue, executor: Executor, compact: bool = False) -> str:
+    if len(classified_dialogue) < 2 * PARALLEL_CHUNK_ROWS:
+        return format_dialogue(classified_dialogue, compact = compact)
+
+    segments = get_segments(classified_dialogue)
+
+    return "".join(render_segments_parallel(segments, compact, executor))
+
+
+class DialogueCache:
+    # Keeps the classification of each row and the HTML of each segment of the dialogues formatted before,
+    # so that formatting a dialogue again after a few edits only processes the rows and segments that changed.
+    def __init__(self, max_rows: int = 100000, max_segments: int = 20000) -> None:
+        self.classified_rows = OrderedDict()
+        self.segments = OrderedDict()
+        self.max_rows = max_rows
+        self.max_segments = max_segments
+        self.text_replacer = (None, TextReplacer({}))
+        self.lock = threading.Lock()
+
+    def classify_dialogue(self, headers: list[str], texts: list[str]) -> tuple[ClassifiedDialogue, list[str]]:
+        rows = list(zip(headers, texts))
+
+        with self.lock, stage("classify_dialogue", rows = len(rows)) as classify_stage:
+            new_rows = list(dict.fromkeys(row for row in rows if row not in self.classified_rows))
+
+            classify_stage.counts["new_rows"] = len(new_rows)
+
+            if new_rows:
+                new_headers, new_texts = zip(*new_rows)
+
+                self.classified_rows.update(zip(new_rows, zip(*classify_rows(new_headers, new_texts))))
+
+            classified_rows = []
+
+            for row in rows:
+                self.classified_rows.move_to_end(row)
+                classified_rows.append(self.classified_rows[row])
+
+            while len(self.classified_rows) > self.max_rows:
+                self.classified_rows.popitem(last = False)
+
+        row_type_codes, classified_headers, formatted_texts, row_variable_text = zip(*classified_rows) if classified_rows else ((), (), (), ())
+
+        classified_dialogue = ClassifiedDialogue(bytes(row_type_codes), list(classified_headers), list(formatted_texts))
+
+        return classified_dialogue, [variable_text for variable_texts in row_variable_text for variable_text in variable_texts]
+
+    def format_dialogue(self, classified_dialogue: ClassifiedDialogue, translations: dict[str, str], compact: bool = False, executor: Executor | None = None) -> str:
+        segments = get_segments(classified_dialogue)
+
+        translations_hash = hash_translations(translations)
+
+        # The rows are cached before their translation, so that unchanged segments are not translated again
+        segment_keys = [(compact, translations_hash, *segment) for segment in segments]
+
+        segments_html = {}
+
+        with self.lock:
+            if self.text_replacer[0] != translations_hash:
+                self.text_replacer = (translations_hash, TextReplacer(translations))
+
+            text_replacer = self.text_replacer[1]
+
+            for segment_key in segment_keys:
+                if segment_key in self.segments:
+                    self.segments.move_to_end(segment_key)
+                    segments_html[segment_key] = self.segments[segment_key]
+
+        new_segment_keys = list(dict.fromkeys(segment_key for segment_key in segment_keys if segment_key not in segments_html))
+
+        # Rendered without holding the lock, so that a large dialogue does not hold up the other sessions
+        with stage("replace_variable_text", segments = len(new_segment_keys), translations = len(translations)):
+            new_segments = [
+                (
+                    segment_row_types,
+                    last_row_type,
+                    next_row_type,
+                    [text_replacer.replace(header) for header in segment_headers],
+                    [text_replacer.replace(text) for text in segment_texts]
+                )
+                for _, _, segment_row_types, last_row_type, next_row_type, segment_headers, segment_texts in new_segment_keys
+            ]
+
+        new_rows_amount = sum(len(segment[0]) for segment in new_segments)
+
+        with stage("render_dialogue", rows = len(classified_dialogue), new_rows = new_rows_amount, segments = len(segment_keys), new_segments = len(new_segments)):
+            if executor is not None and new_rows_amount >= 2 * PARALLEL_CHUNK_ROWS:
+                new_segments_html = render_segments_parallel(new_segments, compact, executor)
+            else:
+                new_segments_html = render_segments(new_segments, compact)
+
+        segments_html.update(zip(new_segment_keys, new_segments_html))
+
+        with self.lock:
+            self.segments.update(zip(new_segment_keys, new_segments_html))
+
+            while len(self.segments) > self.max_segments:
+                self.segments.popitem(last = False)
+
+        return "".join(segments_html[segment_key] for segment_key in segment_keys)
@@ -0,0 +1,179 @@
+import io
+import zipfile
+from collections.abc import Callable
+from concurrent.futures import Executor, as_completed
+
+from core.quest import ClassifiedDialogue, classify_dialogue, classify_headers, format_dialogue, format_objective, replace_variable_text
+from core.timing import stage
+from core.translation_memory import LANGUAGES, TranslationMemory
+from core.xlsx import read_first_sheet_text
+
+
+OBJECTIVE_SECTION_HEADER = "Quest Objective"
+DIALOGUE_SECTION_HEADER = "Dialogue"
+
+
+def find_section(rows: list[list[str]], section_header: str, stop_row_idx: int | None = None) -> tuple[int, int] | None:
+    for row_idx, row in enumerate(rows[:stop_row_idx]):
+        for column_idx, value in enumerate(row):
+            if value.strip() == section_header:
+                return row_idx, column_idx
+
+    return None
+
+
+# Language columns are given by the closest row above the section (or the section row itself) that names at least two languages
+def find_language_columns(rows: list[list[str]], section_row_idx: int, section_header: str) -> dict[str, int]:
+    for row in reversed(rows[:section_row_idx + 1]):
+        language_columns = {value.strip(): column_idx for column_idx, value in enumerate(row) if value.strip() in LANGUAGES}
+
+        if len(language_columns) >= 2:
+            return language_columns
+
+    raise ValueError("No language line (%s) was found above the %s section" % (" ".join(LANGUAGES), section_header))
+
+
+class QuestWorkbook:
+    # The Quest Objective and Dialogue sections of the first sheet of a Quest Team localization workbook,
+    # as their header column and one text column per language
+    def __init__(self, workbook_xlsx) -> None:
+        with stage("read_quest_workbook") as read_stage:
+            rows = read_first_sheet_text(workbook_xlsx)
+
+            read_stage.counts["rows"] = len(rows)
+
+        dialogue_section = find_section(rows, DIALOGUE_SECTION_HEADER)
+
+        if dialogue_section is None:
+            raise ValueError("No %s section was found in the first sheet of the workbook" % DIALOGUE_SECTION_HEADER)
+
+        # Dialogue rows may be headed "Quest Objective" too, only the section header above the dialogue counts
+        objective_section = find_section(rows, OBJECTIVE_SECTION_HEADER, dialogue_section[0])
+
+        self.dialogue = self.read_section(rows, DIALOGUE_SECTION_HEADER, dialogue_section, len(rows))
+        self.objective = self.read_section(rows, OBJECTIVE_SECTION_HEADER, objective_section, dialogue_section[0]) if objective_section is not None else None
+
+        self.languages = [language for language in LANGUAGES if language in self.dialogue]
+
+    @staticmethod
+    def read_section(rows: list[list[str]], section_header: str, section: tuple[int, int], end_row_idx: int) -> dict[str, list[str]]:
+        section_row_idx, header_column_idx = section
+
+        language_columns = find_language_columns(rows, section_row_idx, section_header)
+
+        section_rows = rows[section_row_idx + 1:end_row_idx]
+
+        section_data = {"header": [row[header_column_idx] for row in section_rows]}
+
+        for language, column_idx in language_columns.items():
+            section_data[language] = [row[column_idx] for row in section_rows]
+
+        return section_data
+
+
+# Classifies one language of the workbook and formats its objective. Runs on a worker process, so it only takes and returns plain data.
+def classify_quest_language(objective_headers: list[str] | None, objective_texts: list[str] | None, headers: list[str], texts: list[str], header_type_codes: list[int]) -> tuple[str | None, ClassifiedDialogue, list[str]]:
+    objective_html = format_objective(objective_headers, objective_texts) if objective_texts is not None else None
+
+    classified_dialogue, variable_text = classify_dialogue(headers, texts, header_type_codes)
+
+    return objective_html, classified_dialogue, list(dict.fromkeys(variable_text))
+
+
+def render_quest_language(classified_dialogue: ClassifiedDialogue, translations: dict[str, str], compact: bool) -> str:
+    return format_dialogue(replace_variable_text(classified_dialogue, translations), compact = compact)
+
+
+def get_language_files(objective_html: str | None, dialogue_html: str) -> dict[str, str]:
+    language_files = {}
+
+    if objective_html is not None:
+        language_files["objective.html"] = objective_html
+
+    language_files["dialogue.html"] = dialogue_html
+
+    return language_files
+
+
+# Formats every language of the workbook and bundles the results in a zip file, one directory per language.
+# Languages are classified and rendered on the worker processes of `executor` (one after the other without one), the translations
+# are looked up in between by the calling thread, which owns the translation memory.
+# `progress` is called with the number of languages formatted and the total after each stage of a language, it stops the bundle
+# (cancelling the stages not started yet) by raising.
+def create_quest_bundle(quest_workbook: QuestWorkbook, translation_memory: TranslationMemory, compact: bool = False, progress: Callable[[int, int], None] | None = None, executor: Executor | None = None) -> bytes:
+    # The header column is the same for every language, it is classified once
+    with stage("classify_headers", rows = len(quest_workbook.dialogue["header"])):
+        header_type_codes = classify_headers(quest_workbook.dialogue["header"])
+
+    languages = quest_workbook.languages
+    objective = quest_workbook.objective
+
+    def get_classify_args(language: str) -> tuple:
+        objective_texts = objective.get(language) if objective is not None else None
+
+        return (objective["header"] if objective_texts is not None else None, objective_texts, quest_workbook.dialogue["header"], quest_workbook.dialogue[language], header_type_codes)
+
+    def report_progress() -> None:
+        if progress is not None:
+            progress(len(language_results), len(languages))
+
+    language_results = {}
+
+    report_progress()
+
+    with stage("format_languages", rows = len(quest_workbook.dialogue["header"]), languages = len(languages)):
+        if executor is None:
+            for language in languages:
+                objective_html, classified_dialogue, text_to_translate = classify_quest_language(*get_classify_args(language))
+
+                report_progress()
+
+                known_translations = translation_memory.lookup(language, text_to_translate)
+                dialogue_html = render_quest_language(classified_dialogue, known_translations, compact)
+
+                language_results[language] = (get_language_files(objective_html, dialogue_html), [og_text for og_text in text_to_translate if og_text not in known_translations])
+
+                report_progress()
+        else:
+            classify_futures = {executor.submit(classify_quest_language, *get_classify_args(language)): language for language in languages}
+            render_futures = {}
+
+            try:
+                for classify_future in as_completed(classify_futures):
+                    language = classify_futures[classify_future]
+                    objective_html, classified_dialogue, text_to_translate = classify_future.result()
+
+                    report_progress()
+
+                    known_translations = translation_memory.lookup(language, text_to_translate)
+                    untranslated_text = [og_text for og_text in text_to_translate if og_text not in known_translations]
+
+                    render_futures[executor.submit(render_quest_language, classified_dialogue, known_translations, compact)] = (language, objective_html, untranslated_text)
+
+                for render_future in as_completed(render_futures):
+                    language, objective_html, untranslated_text = render_futures[render_future]
+
+                    language_results[language] = (get_language_files(objective_html, render_future.result()), untranslated_text)
+
+                    report_progress()
+            except BaseException:
+                # The pool is shared, only the stages of this bundle are cancelled
+                for future in [*classify_futures, *render_futures]:
+                    future.cancel()
+
+                raise
+
+    bundle_file = io.BytesIO()
+
+    with zipfile.ZipFile(bundle_file, "w", zipfile.ZIP_DEFLATED) as bundle:
+        for language in languages:
+            language_files, untranslated_text = language_results[language]
+
+            for file_name, file_data in language_files.items():
+                bundle.writestr("%s/%s" % (language, file_name), file_data)
+
+            # Speaker names, locations and placeholders left as they are
+            if untranslated_text:
+                bundle.writestr("%s/untranslated.txt" % language, "\n".join(untranslated_text))
+
+    return bundle_file.getvalue()
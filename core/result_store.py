@@ -0,0 +1,144 @@
+import atexit
+import os
+import re
+import shutil
+import tempfile
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from collections.abc import Callable
+from typing import BinaryIO
+
+
+DEFAULT_MAX_SIZE = 512 * 1024 * 1024
+DEFAULT_TTL = 3600
+
+RESULT_FILE_RE = re.compile(r"[0-9a-f]{32}(?:\.\w+)?")
+
+
+def get_result_store_dir() -> str | None:
+    return os.environ.get("HOYOWIKI_TOOLS_RESULT_DIR")
+
+
+class ResultStore:
+    # Results (spreadsheets, HTML, ...) kept on disk instead of in memory, each known by a handle.
+    # The directory is bounded in size: results expire after `ttl` seconds, and the least recently used ones are removed first.
+    def __init__(self, directory: str | None = None, max_size: int = DEFAULT_MAX_SIZE, ttl: float = DEFAULT_TTL) -> None:
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix = "hoyowiki-tools-results-")
+
+            # No other run can reach this directory, it is removed with the process
+            atexit.register(shutil.rmtree, directory, ignore_errors = True)
+        else:
+            os.makedirs(directory, exist_ok = True)
+
+            # Results left by a previous run cannot be reached anymore
+            for file_name in os.listdir(directory):
+                if RESULT_FILE_RE.fullmatch(file_name):
+                    os.remove(os.path.join(directory, file_name))
+
+        self.directory = directory
+        self.max_size = max_size
+        self.ttl = ttl
+        self.results = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    # The result is written straight to its file, it never has to be held in memory as a whole
+    def put_file(self, write: Callable[[BinaryIO], None], suffix: str = "") -> str:
+        handle = uuid.uuid4().hex
+        path = os.path.join(self.directory, handle + suffix)
+
+        with open(path, "wb") as result_file:
+            try:
+                write(result_file)
+            except BaseException:
+                result_file.close()
+                os.remove(path)
+                raise
+
+        result_size = os.path.getsize(path)
+
+        with self.lock:
+            self.results[handle] = (path, result_size, time.time())
+            self.size += result_size
+
+            self.evict_results()
+
+        return handle
+
+    def put(self, data: bytes | str, suffix: str = "") -> str:
+        if isinstance(data, str):
+            data = data.encode()
+
+        return self.put_file(lambda result_file: result_file.write(data), suffix)
+
+    def get_path(self, handle: str | None) -> str | None:
+        with self.lock:
+            self.evict_results()
+
+            if handle not in self.results:
+                return None
+
+            path, result_size, _ = self.results[handle]
+
+            # Reading a result makes it the most recently used one
+            self.results[handle] = (path, result_size, time.time())
+            self.results.move_to_end(handle)
+
+            return path
+
+    def open(self, handle: str | None) -> BinaryIO | None:
+        path = self.get_path(handle)
+
+        try:
+            return open(path, "rb") if path is not None else None
+        except FileNotFoundError:
+            return None
+
+    def read_text(self, handle: str | None) -> str | None:
+        result_file = self.open(handle)
+
+        if result_file is None:
+            return None
+
+        with result_file:
+            return result_file.read().decode()
+
+    def get_size(self, handle: str | None) -> int | None:
+        with self.lock:
+            return self.results[handle][1] if handle in self.results else None
+
+    def evict_results(self) -> None:
+        expired_time = time.time() - self.ttl
+
+        while self.results:
+            handle, (path, result_size, used_at) = next(iter(self.results.items()))
+
+            # The most recently added result is kept, even if it is bigger than the whole store
+            if used_at >= expired_time and (self.size <= self.max_size or len(self.results) == 1):
+                break
+
+            del self.results[handle]
+            self.size -= result_size
+
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+
+default_result_store = None
+default_result_store_lock = threading.Lock()
+
+
+# The result store shared by every page and session of the server
+def get_result_store() -> ResultStore:
+    global default_result_store
+
+    with default_result_store_lock:
+        if default_result_store is None:
+            default_result_store = ResultStore(get_result_store_dir())
+
+    return default_result_store
@@ -0,0 +1,367 @@
+import argparse
+import asyncio
+import io
+import json
+import multiprocessing
+import os
+import re
+import sys
+import tempfile
+import zipfile
+from collections.abc import Callable
+from concurrent.futures import Executor, ProcessPoolExecutor
+from xml.etree import ElementTree
+
+import tornado.httpserver
+import tornado.ioloop
+import tornado.web
+
+from core.pgc import create_batch_sheet, get_target_rows, read_batch_text, read_template
+from core.quest import classify_dialogue, format_dialogue, format_objective, replace_variable_text
+from core.timing import timed_run
+from core.tsv import iter_tsv_rows
+
+
+DEFAULT_PORT = 8765
+DEFAULT_MAX_BODY_SIZE = 256 * 1024 * 1024
+DEFAULT_MAX_JOBS = 1000
+
+# Idle keep-alive connections are closed after this many seconds
+IDLE_CONNECTION_TIMEOUT = 300
+
+STREAM_CHUNK_SIZE = 256 * 1024
+
+TSV_CONTENT_TYPE = "text/tab-separated-values"
+
+# Files of a PGC upload are named the way core.pgc_batch reads them from a directory: `<name>.xlsx` and `<name>.R<row>.tsv`
+BATCH_TEXT_NAME_RE = re.compile(r"(.+)\.R(\d+)\.tsv")
+
+
+# The header and text columns of a job, given as two lists or as tab-separated lines.
+# Empty lines are blank rows of the dialogue, they are kept.
+def read_rows(job: dict) -> tuple[list[str], list[str]]:
+    if "tsv" in job:
+        if not isinstance(job["tsv"], str):
+            raise ValueError("tsv must be a string")
+
+        headers = []
+        texts = []
+
+        for line_number, values in iter_tsv_rows(job["tsv"], keep_empty_lines = True):
+            if len(values) > 2:
+                raise ValueError("line %s: expected a header and a text, found %s values" % (line_number, len(values)))
+
+            headers.append(values[0])
+            texts.append(values[1] if len(values) == 2 else "")
+
+        return headers, texts
+
+    headers = job.get("header")
+    texts = job.get("text")
+
+    if not isinstance(headers, list) or not isinstance(texts, list):
+        raise ValueError("Expected a header list and a text list, or tsv")
+
+    if len(headers) != len(texts):
+        raise ValueError("The header list has %s rows, but the text list has %s" % (len(headers), len(texts)))
+
+    # Empty cells may be given as null
+    return ["" if header is None else str(header) for header in headers], ["" if text is None else str(text) for text in texts]
+
+
+# Jobs are run by the worker processes, they are given and return plain data
+def run_objective_job(job: dict) -> dict:
+    with timed_run("Service objective"):
+        return {"html": format_objective(*read_rows(job))}
+
+
+def run_dialogue_job(job: dict) -> dict:
+    translations = job.get("translations") or {}
+
+    if not isinstance(translations, dict) or not all(isinstance(translated_text, str) for translated_text in translations.values()):
+        raise ValueError("translations must map each text to its translation")
+
+    with timed_run("Service dialogue"):
+        classified_dialogue, variable_text = classify_dialogue(*read_rows(job))
+
+        classified_dialogue = replace_variable_text(classified_dialogue, translations)
+
+        html_data = format_dialogue(classified_dialogue, compact = bool(job.get("compact", False)))
+
+    # Speaker names, locations and placeholders the translation map did not cover
+    return {"html": html_data, "untranslated": [og_text for og_text in dict.fromkeys(variable_text) if og_text not in translations]}
+
+
+def run_pgc_job(template_name: str, template_data: bytes, batch_texts: dict[int, str], output_path: str) -> str:
+    with timed_run("Service PGC %s" % template_name):
+        try:
+            template_df = read_template(io.BytesIO(template_data))
+        except (zipfile.BadZipFile, KeyError, ElementTree.ParseError) as error:
+            raise ValueError("%s.xlsx is not a readable spreadsheet: %s" % (template_name, error)) from None
+        target_rows = get_target_rows(template_df)
+
+        for idx in target_rows["idx"]:
+            if idx not in batch_texts:
+                raise ValueError("Missing batch text for row R%s of %s: %s.R%s.tsv" % (idx, template_name, template_name, idx))
+
+        read_batch_text(target_rows, [batch_texts[idx] for idx in target_rows["idx"]])
+
+        with open(output_path, "wb") as batch_file:
+            create_batch_sheet(template_df, target_rows, batch_file)
+
+    return output_path
+
+
+# Templates and batch texts of an upload, by template name
+def read_pgc_upload(files: dict) -> dict[str, tuple[bytes, dict[int, str]]]:
+    templates = {}
+    batch_texts = {}
+
+    for uploaded_file in (uploaded_file for field_files in files.values() for uploaded_file in field_files):
+        file_name = os.path.basename(uploaded_file.filename)
+        batch_text_name = BATCH_TEXT_NAME_RE.fullmatch(file_name)
+
+        if file_name.endswith(".xlsx"):
+            templates[file_name[:-len(".xlsx")]] = uploaded_file.body
+        elif batch_text_name is not None:
+            try:
+                batch_texts.setdefault(batch_text_name[1], {})[int(batch_text_name[2])] = uploaded_file.body.decode("utf-8")
+            except UnicodeDecodeError:
+                raise ValueError("%s is not UTF-8 text" % file_name)
+        else:
+            raise ValueError("Unexpected file %s, expected <name>.xlsx templates and <name>.R<row>.tsv batch texts" % file_name)
+
+    if not templates:
+        raise ValueError("No template was uploaded")
+
+    for template_name in batch_texts:
+        if template_name not in templates:
+            raise ValueError("No template was uploaded for %s.R<row>.tsv" % template_name)
+
+    return {template_name: (template_data, batch_texts.get(template_name, {})) for template_name, template_data in templates.items()}
+
+
+class ServiceHandler(tornado.web.RequestHandler):
+    def initialize(self, executor: Executor, max_jobs: int) -> None:
+        self.executor = executor
+        self.max_jobs = max_jobs
+
+    def write_error(self, status_code: int, **kwargs) -> None:
+        error = kwargs["exc_info"][1] if "exc_info" in kwargs else None
+
+        if isinstance(error, tornado.web.HTTPError) and error.log_message:
+            message = error.log_message
+        else:
+            message = self._reason
+
+        self.finish({"error": message})
+
+    def read_json(self) -> dict:
+        try:
+            body = json.loads(self.request.body)
+        except ValueError as error:
+            raise tornado.web.HTTPError(400, "Invalid JSON: %s" % error)
+
+        if not isinstance(body, dict):
+            raise tornado.web.HTTPError(400, "Expected a JSON object")
+
+        return body
+
+    def is_tsv(self) -> bool:
+        return self.request.headers.get("Content-Type", "").split(";")[0].strip() == TSV_CONTENT_TYPE
+
+    def read_tsv(self) -> str:
+        try:
+            return self.request.body.decode("utf-8")
+        except UnicodeDecodeError:
+            raise tornado.web.HTTPError(400, "The TSV body is not UTF-8 text")
+
+    # A single job, its errors are the errors of the request
+    async def run_job(self, run: Callable, *args):
+        try:
+            return await asyncio.wrap_future(self.executor.submit(run, *args))
+        except ValueError as error:
+            raise tornado.web.HTTPError(400, str(error))
+
+    # Every job of the batch runs on the pool at once, a failed job does not fail the others
+    async def run_jobs(self, run: Callable, jobs: list) -> list[dict]:
+        if not isinstance(jobs, list):
+            raise tornado.web.HTTPError(400, "Expected a list of jobs")
+
+        if len(jobs) > self.max_jobs:
+            raise tornado.web.HTTPError(400, "A batch holds at most %s jobs, %s were given" % (self.max_jobs, len(jobs)))
+
+        futures = [asyncio.wrap_future(self.executor.submit(run, job if isinstance(job, dict) else {})) for job in jobs]
+        results = await asyncio.gather(*futures, return_exceptions = True)
+
+        return [{"error": str(result)} if isinstance(result, Exception) else result for result in results]
+
+    async def send_file(self, path: str, content_type: str, file_name: str) -> None:
+        self.set_header("Content-Type", content_type)
+        self.set_header("Content-Disposition", 'attachment; filename="%s"' % file_name)
+        self.set_header("Content-Length", os.path.getsize(path))
+
+        # Sent in chunks as the client reads them, the file is never held in memory
+        with open(path, "rb") as sent_file:
+            while chunk := sent_file.read(STREAM_CHUNK_SIZE):
+                self.write(chunk)
+                await self.flush()
+
+
+class HealthHandler(ServiceHandler):
+    def get(self) -> None:
+        self.write({"status": "ok"})
+
+
+# JSON ({"header": [...], "text": [...]} or {"tsv": "..."}) gives JSON back, TSV gives the HTML itself
+class ObjectiveHandler(ServiceHandler):
+    async def post(self) -> None:
+        if self.is_tsv():
+            result = await self.run_job(run_objective_job, {"tsv": self.read_tsv()})
+
+            self.set_header("Content-Type", "text/html; charset=utf-8")
+            self.write(result["html"])
+        else:
+            self.write(await self.run_job(run_objective_job, self.read_json()))
+
+
+# JSON jobs may also hold "translations" and "compact". TSV takes `compact` as a query argument.
+class DialogueHandler(ServiceHandler):
+    async def post(self) -> None:
+        if self.is_tsv():
+            job = {"tsv": self.read_tsv(), "compact": self.get_query_argument("compact", "0") not in ("", "0", "false")}
+
+            result = await self.run_job(run_dialogue_job, job)
+
+            self.set_header("Content-Type", "text/html; charset=utf-8")
+            self.write(result["html"])
+        else:
+            self.write(await self.run_job(run_dialogue_job, self.read_json()))
+
+
+class BatchObjectiveHandler(ServiceHandler):
+    async def post(self) -> None:
+        self.write({"results": await self.run_jobs(run_objective_job, self.read_json().get("jobs"))})
+
+
+class BatchDialogueHandler(ServiceHandler):
+    async def post(self) -> None:
+        self.write({"results": await self.run_jobs(run_dialogue_job, self.read_json().get("jobs"))})
+
+
+# A multipart upload of one template and its batch texts, the PGC spreadsheet is sent back
+class PgcHandler(ServiceHandler):
+    async def post(self) -> None:
+        try:
+            pgc_jobs = read_pgc_upload(self.request.files)
+        except ValueError as error:
+            raise tornado.web.HTTPError(400, str(error))
+
+        if len(pgc_jobs) != 1:
+            raise tornado.web.HTTPError(400, "Expected one template, %s were uploaded (see /batch/pgc)" % len(pgc_jobs))
+
+        (template_name, (template_data, batch_texts)), = pgc_jobs.items()
+
+        with tempfile.TemporaryDirectory(prefix = "hoyowiki-tools-service-") as output_dir:
+            output_path = await self.run_job(run_pgc_job, template_name, template_data, batch_texts, os.path.join(output_dir, "batch.xlsx"))
+
+            await self.send_file(output_path, "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", "PGC_BATCH_OUT_%s.xlsx" % template_name)
+
+
+# Any number of templates with their batch texts, the PGC spreadsheets are sent back in a zip file.
+# Templates that fail are listed in errors.txt.
+class BatchPgcHandler(ServiceHandler):
+    async def post(self) -> None:
+        try:
+            pgc_jobs = read_pgc_upload(self.request.files)
+        except ValueError as error:
+            raise tornado.web.HTTPError(400, str(error))
+
+        if len(pgc_jobs) > self.max_jobs:
+            raise tornado.web.HTTPError(400, "A batch holds at most %s jobs, %s were given" % (self.max_jobs, len(pgc_jobs)))
+
+        with tempfile.TemporaryDirectory(prefix = "hoyowiki-tools-service-") as output_dir:
+            futures = [
+                asyncio.wrap_future(self.executor.submit(run_pgc_job, template_name, template_data, batch_texts, os.path.join(output_dir, "%s.xlsx" % job_counter)))
+                for job_counter, (template_name, (template_data, batch_texts)) in enumerate(pgc_jobs.items())
+            ]
+
+            results = await asyncio.gather(*futures, return_exceptions = True)
+
+            bundle_path = os.path.join(output_dir, "bundle.zip")
+            errors = []
+
+            # The spreadsheets are already compressed
+            with zipfile.ZipFile(bundle_path, "w", zipfile.ZIP_STORED) as bundle:
+                for template_name, result in zip(pgc_jobs, results):
+                    if isinstance(result, Exception):
+                        errors.append("%s: %s" % (template_name, result))
+                    else:
+                        bundle.write(result, "PGC_BATCH_OUT_%s.xlsx" % template_name)
+
+                if errors:
+                    bundle.writestr("errors.txt", "\n".join(errors))
+
+            self.set_header("X-Failed-Jobs", len(errors))
+
+            await self.send_file(bundle_path, "application/zip", "PGC_BATCH_OUT.zip")
+
+
+def make_app(executor: Executor, max_jobs: int = DEFAULT_MAX_JOBS) -> tornado.web.Application:
+    handler_args = {"executor": executor, "max_jobs": max_jobs}
+
+    return tornado.web.Application([
+        (r"/health", HealthHandler, handler_args),
+        (r"/objective", ObjectiveHandler, handler_args),
+        (r"/dialogue", DialogueHandler, handler_args),
+        (r"/pgc", PgcHandler, handler_args),
+        (r"/batch/objective", BatchObjectiveHandler, handler_args),
+        (r"/batch/dialogue", BatchDialogueHandler, handler_args),
+        (r"/batch/pgc", BatchPgcHandler, handler_args)
+    ])
+
+
+def parse_args(argv: list[str]) -> argparse.Namespace:
+    parser = argparse.ArgumentParser(
+        prog = "python -m core.service",
+        description = "Serves the Quest Formatter and the PGC Creator over HTTP, with batch endpoints that run many jobs per request."
+    )
+
+    parser.add_argument("--host", default = "127.0.0.1", help = "address to listen on (defaults to 127.0.0.1)")
+    parser.add_argument("--port", type = int, default = DEFAULT_PORT, help = "port to listen on (defaults to %s)" % DEFAULT_PORT)
+    parser.add_argument("--workers", type = int, default = None, help = "number of worker processes (defaults to the number of CPUs)")
+    parser.add_argument("--max-jobs", type = int, default = DEFAULT_MAX_JOBS, help = "maximum number of jobs of a batch request (defaults to %s)" % DEFAULT_MAX_JOBS)
+    parser.add_argument("--max-body-size", type = int, default = DEFAULT_MAX_BODY_SIZE // (1024 * 1024), help = "maximum request size in MB (defaults to %s)" % (DEFAULT_MAX_BODY_SIZE // (1024 * 1024)))
+
+    return parser.parse_args(argv)
+
+
+def main(argv: list[str] | None = None) -> int:
+    args = parse_args(sys.argv[1:] if argv is None else argv)
+
+    # Workers are spawned rather than forked from the running server
+    executor = ProcessPoolExecutor(max_workers = args.workers, mp_context = multiprocessing.get_context("spawn"))
+
+    server = tornado.httpserver.HTTPServer(
+        make_app(executor, args.max_jobs),
+        max_body_size = args.max_body_size * 1024 * 1024,
+        idle_connection_timeout = IDLE_CONNECTION_TIMEOUT
+    )
+
+    server.listen(args.port, args.host)
+
+    print("Listening on http://%s:%s" % (args.host, args.port))
+
+    try:
+        tornado.ioloop.IOLoop.current().start()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.stop()
+        executor.shutdown(cancel_futures = True)
+
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
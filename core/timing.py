@@ -0,0 +1,163 @@
+import contextvars
+import json
+import logging
+import os
+import sys
+import threading
+import time
+import tracemalloc
+import uuid
+
+# Only available on Unix, the peak resident size is left out of the stages elsewhere
+try:
+    import resource
+except ImportError:
+    resource = None
+
+
+TIMING_ENV = "HOYOWIKI_TOOLS_TIMING"
+
+# Value of TIMING_ENV that also traces the memory allocated by each stage. Tracing makes Python code several times slower,
+# for every session of the server, so the times of traced stages are only meaningful relative to each other.
+TRACE_MEMORY_VALUE = "memory"
+
+logger = logging.getLogger("hoyowiki_tools.timing")
+
+current_run = contextvars.ContextVar("current_run", default = None)
+
+
+def timing_enabled() -> bool:
+    return os.environ.get(TIMING_ENV, "") not in ("", "0")
+
+
+def memory_tracing_enabled() -> bool:
+    return os.environ.get(TIMING_ENV, "") == TRACE_MEMORY_VALUE
+
+
+# Peak resident size of the process so far, cheap to read. Linux gives it in kilobytes, macOS in bytes.
+def get_peak_rss_mb() -> float | None:
+    if resource is None:
+        return None
+
+    peak_rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return round(peak_rss / (1024 * 1024 if sys.platform == "darwin" else 1024), 3)
+
+
+class TimedRun:
+    # The stages of one run of a tool (wall time, peak memory, row and sheet counts), also written to the log as JSON lines.
+    # Stages opened while the run is entered are recorded in it, including in the background jobs it submits.
+    def __init__(self, name: str) -> None:
+        self.id = uuid.uuid4().hex[:8]
+        self.name = name
+        self.stages = []
+        self.lock = threading.Lock()
+        self.tokens = []
+
+    def __enter__(self) -> "TimedRun":
+        self.tokens.append(current_run.set(self))
+
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        current_run.reset(self.tokens.pop())
+
+    def record(self, stage_record: dict) -> None:
+        with self.lock:
+            self.stages.append(stage_record)
+
+        logger.info(json.dumps({"run": self.name, "run_id": self.id, **stage_record}, ensure_ascii = False))
+
+
+class Stage:
+    def __init__(self, run: TimedRun, name: str, counts: dict) -> None:
+        self.run = run
+        self.name = name
+        self.counts = counts
+
+    def __enter__(self) -> "Stage":
+        self.traced = tracemalloc.is_tracing()
+
+        # Memory is traced for the whole process, concurrent runs share the same peak
+        if self.traced:
+            tracemalloc.reset_peak()
+
+            self.start_memory = tracemalloc.get_traced_memory()[0]
+
+        self.start_time = time.perf_counter()
+
+        return self
+
+    def __exit__(self, exc_type, *exc_info) -> None:
+        seconds = time.perf_counter() - self.start_time
+
+        stage_record = {"stage": self.name, "seconds": round(seconds, 6), "peak_rss_mb": get_peak_rss_mb()}
+
+        # The time of a traced stage is slowed down by the tracing, it is flagged as such
+        if self.traced:
+            stage_record["peak_memory_mb"] = round((tracemalloc.get_traced_memory()[1] - self.start_memory) / 1024 / 1024, 3)
+            stage_record["traced"] = True
+
+        self.run.record({**stage_record, "failed": exc_type is not None, **self.counts})
+
+
+class NullCounts(dict):
+    # Counts written to a stage while timing is turned off are dropped, the stage object is shared by every thread
+    def __setitem__(self, key: str, value: int) -> None:
+        pass
+
+
+class NullStage:
+    # What stage gives when timing is turned off: it records nothing and costs nothing
+    counts = NullCounts()
+
+    def __enter__(self) -> "NullStage":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+NULL_STAGE = NullStage()
+
+
+class NullRun:
+    # What timed_run gives when timing is turned off
+    stages = ()
+
+    def __enter__(self) -> "NullRun":
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        pass
+
+
+NULL_RUN = NullRun()
+
+
+def timed_run(name: str) -> TimedRun | NullRun:
+    if not timing_enabled():
+        return NULL_RUN
+
+    if memory_tracing_enabled() and not tracemalloc.is_tracing():
+        tracemalloc.start()
+
+    if not logger.handlers:
+        handler = logging.StreamHandler()
+        handler.setFormatter(logging.Formatter("%(message)s"))
+
+        logger.addHandler(handler)
+        logger.setLevel(logging.INFO)
+        logger.propagate = False
+
+    return TimedRun(name)
+
+
+# Times a stage of the current run. Counts (rows, sheets, ...) can be given upfront or added to `counts` during the stage.
+def stage(name: str, **counts) -> Stage | NullStage:
+    run = current_run.get()
+
+    if run is None:
+        return NULL_STAGE
+
+    return Stage(run, name, counts)
@@ -0,0 +1,93 @@
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+LANGUAGES = ("CHS", "CHT", "DE", "EN", "ES", "FR", "ID", "IT", "JP", "KR", "PT", "RU", "TH", "TR", "VI")
+
+DEFAULT_TRANSLATION_MEMORY_PATH = os.path.join(os.path.expanduser("~"), ".cache", "hoyowiki-tools", "translation_memory.sqlite3")
+
+# SQLite limits the number of parameters of a single query
+LOOKUP_CHUNK_SIZE = 500
+
+
+def get_translation_memory_path() -> str:
+    return os.environ.get("HOYOWIKI_TOOLS_TRANSLATION_MEMORY", DEFAULT_TRANSLATION_MEMORY_PATH)
+
+
+class TranslationMemory:
+    # Translations of speaker names, locations and placeholders, kept on disk by language.
+    # The most recently used entries (including the texts known to have no translation) are kept in memory.
+    def __init__(self, path: str, cache_size: int = 8192) -> None:
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok = True)
+
+        self.connection = sqlite3.connect(path, check_same_thread = False)
+        self.connection.execute("""
+            CREATE TABLE IF NOT EXISTS translations (
+                language TEXT NOT NULL,
+                source_text TEXT NOT NULL,
+                translated_text TEXT NOT NULL,
+                updated_at REAL NOT NULL,
+                PRIMARY KEY (language, source_text)
+            )
+        """)
+        self.connection.commit()
+
+        self.cache = OrderedDict()
+        self.cache_size = cache_size
+        self.lock = threading.Lock()
+
+    def cache_translation(self, language: str, source_text: str, translated_text: str | None) -> None:
+        self.cache[(language, source_text)] = translated_text
+        self.cache.move_to_end((language, source_text))
+
+        if len(self.cache) > self.cache_size:
+            self.cache.popitem(last = False)
+
+    def lookup(self, language: str, source_texts: list[str]) -> dict[str, str]:
+        translations = {}
+        missed_texts = []
+
+        with self.lock:
+            for source_text in dict.fromkeys(source_texts):
+                if (language, source_text) in self.cache:
+                    self.cache.move_to_end((language, source_text))
+
+                    if self.cache[(language, source_text)] is not None:
+                        translations[source_text] = self.cache[(language, source_text)]
+                else:
+                    missed_texts.append(source_text)
+
+            for chunk_start in range(0, len(missed_texts), LOOKUP_CHUNK_SIZE):
+                chunk = missed_texts[chunk_start:chunk_start + LOOKUP_CHUNK_SIZE]
+
+                rows = self.connection.execute(
+                    "SELECT source_text, translated_text FROM translations WHERE language = ? AND source_text IN (%s)" % ", ".join("?" * len(chunk)),
+                    [language, *chunk]
+                ).fetchall()
+
+                found_translations = dict(rows)
+
+                for source_text in chunk:
+                    self.cache_translation(language, source_text, found_translations.get(source_text))
+
+                translations.update(found_translations)
+
+        return translations
+
+    def store(self, language: str, translations: dict[str, str]) -> None:
+        updated_at = time.time()
+
+        with self.lock:
+            self.connection.executemany(
+                "INSERT INTO translations (language, source_text, translated_text, updated_at) VALUES (?, ?, ?, ?) "
+                "ON CONFLICT (language, source_text) DO UPDATE SET translated_text = excluded.translated_text, updated_at = excluded.updated_at",
+                [(language, source_text, translated_text, updated_at) for source_text, translated_text in translations.items()]
+            )
+            self.connection.commit()
+
+            for source_text, translated_text in translations.items():
+                self.cache_translation(language, source_text, translated_text)
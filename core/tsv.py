@@ -0,0 +1,111 @@
+from collections.abc import Iterable, Iterator
+
+
+# Lines of a text, with their line break, without copying the whole text again
+def iter_lines(text: str) -> Iterator[str]:
+    line_start = 0
+
+    while line_start < len(text):
+        line_end = text.find("\n", line_start)
+
+        if line_end == -1:
+            yield text[line_start:]
+            return
+
+        yield text[line_start:line_end + 1]
+
+        line_start = line_end + 1
+
+
+def strip_line_break(line: str) -> str:
+    if line.endswith("\r\n"):
+        return line[:-2]
+
+    if line.endswith("\n"):
+        return line[:-1]
+
+    return line
+
+
+# Reads tab-separated values as Excel and Google Sheets copy them (RFC 4180 with tabs): cells containing line breaks,
+# tabs or quotes are quoted, and quotes are doubled inside them. Yields the number of the first line of each row with its values.
+# Empty lines are skipped, or read as a row with a single empty value with `keep_empty_lines`.
+def iter_tsv_rows(lines: Iterable[str] | str, keep_empty_lines: bool = False) -> Iterator[tuple[int, list[str]]]:
+    if isinstance(lines, str):
+        lines = iter_lines(lines)
+
+    values = []
+    quoted_parts = None
+    row_line_number = None
+
+    for line_number, line in enumerate(lines, start = 1):
+        if row_line_number is None:
+            row_line_number = line_number
+
+        # Most lines have no quoted cell
+        if quoted_parts is None and '"' not in line:
+            line = strip_line_break(line)
+
+            if line or keep_empty_lines:
+                yield row_line_number, line.split("\t")
+
+            row_line_number = None
+
+            continue
+
+        position = 0
+
+        while True:
+            if quoted_parts is not None:
+                quote_position = line.find('"', position)
+
+                # The cell goes on on the next line, with the line break
+                if quote_position == -1:
+                    quoted_parts.append(line[position:])
+                    break
+
+                quoted_parts.append(line[position:quote_position])
+
+                # A doubled quote is a quote of the text
+                if line.startswith('"', quote_position + 1):
+                    quoted_parts.append('"')
+                    position = quote_position + 2
+                    continue
+
+                values.append("".join(quoted_parts))
+                quoted_parts = None
+                position = quote_position + 1
+
+                rest = strip_line_break(line[position:])
+
+                if rest == "":
+                    yield row_line_number, values
+
+                    values = []
+                    row_line_number = None
+                    break
+
+                if not rest.startswith("\t"):
+                    raise ValueError("line %s: unexpected text after a quoted cell: %s" % (line_number, rest.split("\t")[0]))
+
+                position += 1
+            elif line.startswith('"', position):
+                quoted_parts = []
+                position += 1
+            else:
+                tab_position = line.find("\t", position)
+
+                if tab_position == -1:
+                    values.append(strip_line_break(line[position:]))
+
+                    yield row_line_number, values
+
+                    values = []
+                    row_line_number = None
+                    break
+
+                values.append(line[position:tab_position])
+                position = tab_position + 1
+
+    if quoted_parts is not None:
+        raise ValueError("line %s: a quoted cell is never closed" % row_line_number)
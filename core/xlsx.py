@@ -0,0 +1,419 @@
+import numbers
+import posixpath
+import re
+import zipfile
+from collections.abc import Iterator
+from datetime import datetime
+from xml.etree import ElementTree
+from xml.sax.saxutils import escape
+
+
+MAIN_NAMESPACE = "http://schemas.openxmlformats.org/spreadsheetml/2006/main"
+RELATIONSHIPS_NAMESPACE = "http://schemas.openxmlformats.org/officeDocument/2006/relationships"
+PACKAGE_RELATIONSHIPS_NAMESPACE = "http://schemas.openxmlformats.org/package/2006/relationships"
+
+# Same rules as openpyxl, so that stamped workbooks hold the same cell types as the ones written through pandas
+ILLEGAL_CHARACTERS_RE = re.compile(r"[\000-\010]|[\013-\014]|[\016-\037]")
+ERROR_CODES = ("#NULL!", "#DIV/0!", "#VALUE!", "#REF!", "#NAME?", "#NUM!", "#N/A")
+
+CONTENT_TYPES_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types"><Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/><Default Extension="xml" ContentType="application/xml"/><Override PartName="/xl/workbook.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/><Override PartName="/xl/styles.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/><Override PartName="/xl/sharedStrings.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>%s</Types>"""
+
+CONTENT_TYPE_SHEET_XML = """<Override PartName="/xl/worksheets/sheet%s.xml" ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>"""
+
+ROOT_RELS_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="%s"><Relationship Id="rId1" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/officeDocument" Target="xl/workbook.xml"/></Relationships>""" % PACKAGE_RELATIONSHIPS_NAMESPACE
+
+WORKBOOK_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<workbook xmlns="%s" xmlns:r="%s"><bookViews><workbookView activeTab="0"/></bookViews><sheets>%%s</sheets></workbook>""" % (MAIN_NAMESPACE, RELATIONSHIPS_NAMESPACE)
+
+WORKBOOK_RELS_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<Relationships xmlns="%s">%%s<Relationship Id="rIdStyles" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/styles" Target="styles.xml"/><Relationship Id="rIdStrings" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/sharedStrings" Target="sharedStrings.xml"/></Relationships>""" % PACKAGE_RELATIONSHIPS_NAMESPACE
+
+WORKBOOK_SHEET_REL_XML = """<Relationship Id="rId%s" Type="http://schemas.openxmlformats.org/officeDocument/2006/relationships/worksheet" Target="worksheets/sheet%s.xml"/>"""
+
+STYLES_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<styleSheet xmlns="%s"><fonts count="1"><font><sz val="11"/><name val="Calibri"/><family val="2"/></font></fonts><fills count="2"><fill><patternFill patternType="none"/></fill><fill><patternFill patternType="gray125"/></fill></fills><borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders><cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs><cellXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/></cellXfs><cellStyles count="1"><cellStyle name="Normal" xfId="0" builtinId="0"/></cellStyles></styleSheet>""" % MAIN_NAMESPACE
+
+SHEET_HEAD_XML = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<worksheet xmlns="%s"><sheetData>""" % MAIN_NAMESPACE
+SHEET_TAIL_XML = "</sheetData></worksheet>"
+
+MAIN_TAG = "{%s}%%s" % MAIN_NAMESPACE
+RELATIONSHIP_ID_ATTRIBUTE = "{%s}id" % RELATIONSHIPS_NAMESPACE
+CELL_REF_RE = re.compile(r"([A-Z]+)(\d+)")
+
+# A1 reference of a cell range, with an optional sheet name (Sheet1!D2:R101, 'My sheet'!D2:R, D:R, D2, ...)
+CELL_RANGE_RE = re.compile(
+    r"(?:(?:'(?P<quoted_sheet_name>(?:[^']|'')+)'|(?P<sheet_name>[^!']+))!)?"
+    r"\$?(?P<first_column>[A-Z]{1,3})\$?(?P<first_row>[1-9]\d*)?"
+    r"(?::\$?(?P<last_column>[A-Z]{1,3})\$?(?P<last_row>[1-9]\d*)?)?"
+)
+
+
+def column_letter(column_idx: int) -> str:
+    letters = ""
+    column_number = column_idx + 1
+
+    while column_number > 0:
+        column_number, remainder = divmod(column_number - 1, 26)
+        letters = chr(65 + remainder) + letters
+
+    return letters
+
+
+class CellRange:
+    # A range of cells read from an A1 reference. Without a last row, the range goes on until the end of the sheet.
+    def __init__(self, reference: str) -> None:
+        # Sheet names are kept as they are, column letters can be given in lower case
+        sheet_part, separator, cell_part = reference.strip().rpartition("!")
+
+        match = CELL_RANGE_RE.fullmatch(sheet_part + separator + cell_part.upper())
+
+        if match is None:
+            raise ValueError("%s is not a valid cell range (e.g. D2:R101 or Sheet1!D2:R)" % reference)
+
+        if match["quoted_sheet_name"] is not None:
+            self.sheet_name = match["quoted_sheet_name"].replace("''", "'")
+        else:
+            self.sheet_name = match["sheet_name"]
+
+        self.first_column_idx = column_idx(match["first_column"])
+        self.last_column_idx = column_idx(match["last_column"] or match["first_column"])
+        self.first_row = int(match["first_row"] or 1)
+
+        if match["last_column"] is None:
+            self.last_row = self.first_row if match["first_row"] is not None else None
+        else:
+            self.last_row = int(match["last_row"]) if match["last_row"] is not None else None
+
+        if self.last_column_idx < self.first_column_idx or (self.last_row is not None and self.last_row < self.first_row):
+            raise ValueError("%s is not a valid cell range, it ends before it starts" % reference)
+
+        self.width = self.last_column_idx - self.first_column_idx + 1
+
+    def __contains__(self, row_number: int) -> bool:
+        return self.first_row <= row_number and (self.last_row is None or row_number <= self.last_row)
+
+    def get_values(self, row: list) -> list:
+        values = row[self.first_column_idx:self.last_column_idx + 1]
+
+        return values + [None] * (self.width - len(values))
+
+
+def column_idx(letters: str) -> int:
+    column_number = 0
+
+    for letter in letters:
+        column_number = column_number * 26 + ord(letter) - 64
+
+    return column_number - 1
+
+
+def read_text(element: ElementTree.Element) -> str:
+    # Plain and rich text alike, without the phonetic hints (rPh) some Japanese texts carry
+    text_element = element.find(MAIN_TAG % "t")
+
+    if text_element is not None:
+        return text_element.text or ""
+
+    return "".join(run_text.text or "" for run_text in element.iterfind("%s/%s" % (MAIN_TAG % "r", MAIN_TAG % "t")))
+
+
+def read_date_styles(archive: zipfile.ZipFile) -> set[int]:
+    # Imported here, only workbooks with styles need them
+    from openpyxl.styles.numbers import BUILTIN_FORMATS, is_date_format
+
+    if "xl/styles.xml" not in archive.namelist():
+        return set()
+
+    styles = ElementTree.fromstring(archive.read("xl/styles.xml"))
+
+    number_formats = dict(BUILTIN_FORMATS)
+
+    for number_format in styles.iterfind("%s/%s" % (MAIN_TAG % "numFmts", MAIN_TAG % "numFmt")):
+        number_formats[int(number_format.get("numFmtId"))] = number_format.get("formatCode")
+
+    cell_formats = styles.iterfind("%s/%s" % (MAIN_TAG % "cellXfs", MAIN_TAG % "xf"))
+
+    return {
+        style_idx for style_idx, cell_format in enumerate(cell_formats)
+        if is_date_format(number_formats.get(int(cell_format.get("numFmtId", 0)), "General"))
+    }
+
+
+# Reads the cell values of a sheet (the first one by default) straight from its XML, the same values openpyxl gives in read-only mode.
+# Yields the number of each row with its values, rows are read one at a time.
+def iter_sheet_rows(file, sheet_name: str | None = None) -> Iterator[tuple[int, list]]:
+    from openpyxl.utils.datetime import CALENDAR_MAC_1904, CALENDAR_WINDOWS_1900, from_excel
+
+    with zipfile.ZipFile(file) as archive:
+        workbook = ElementTree.fromstring(archive.read("xl/workbook.xml"))
+        workbook_rels = ElementTree.fromstring(archive.read("xl/_rels/workbook.xml.rels"))
+
+        sheets = workbook.findall("%s/%s" % (MAIN_TAG % "sheets", MAIN_TAG % "sheet"))
+
+        if sheet_name is None:
+            sheet = sheets[0] if sheets else None
+        else:
+            sheet = next((sheet for sheet in sheets if sheet.get("name") == sheet_name), None)
+
+        if sheet is None:
+            raise ValueError("The workbook has no sheet named %s" % sheet_name if sheet_name is not None else "The workbook has no sheet")
+
+        sheet_target = next(
+            relationship.get("Target") for relationship in workbook_rels
+            if relationship.get("Id") == sheet.get(RELATIONSHIP_ID_ATTRIBUTE)
+        )
+        sheet_path = sheet_target.lstrip("/") if sheet_target.startswith("/") else posixpath.normpath(posixpath.join("xl", sheet_target))
+
+        workbook_properties = workbook.find(MAIN_TAG % "workbookPr")
+        epoch = CALENDAR_MAC_1904 if workbook_properties is not None and workbook_properties.get("date1904") in ("1", "true") else CALENDAR_WINDOWS_1900
+
+        shared_strings = []
+
+        if "xl/sharedStrings.xml" in archive.namelist():
+            for _, element in ElementTree.iterparse(archive.open("xl/sharedStrings.xml")):
+                if element.tag == MAIN_TAG % "si":
+                    shared_strings.append(read_text(element))
+                    element.clear()
+
+        date_styles = read_date_styles(archive)
+
+        row_number = 0
+
+        for _, element in ElementTree.iterparse(archive.open(sheet_path)):
+            if element.tag != MAIN_TAG % "row":
+                continue
+
+            row_number = int(element.get("r", row_number + 1))
+
+            row = []
+
+            for cell in element.iterfind(MAIN_TAG % "c"):
+                cell_ref = cell.get("r")
+
+                if cell_ref is not None:
+                    cell_column_idx = column_idx(CELL_REF_RE.match(cell_ref)[1])
+
+                    while len(row) < cell_column_idx:
+                        row.append(None)
+
+                cell_type = cell.get("t", "n")
+                value_element = cell.find(MAIN_TAG % "v")
+                value = value_element.text if value_element is not None else None
+
+                match cell_type:
+                    case "s":
+                        value = shared_strings[int(value)] if value is not None else None
+                    case "inlineStr":
+                        inline_string = cell.find(MAIN_TAG % "is")
+                        value = read_text(inline_string) if inline_string is not None else None
+                    case "b":
+                        value = value == "1" if value is not None else None
+                    case "d":
+                        value = datetime.fromisoformat(value) if value is not None else None
+                    case "n":
+                        if value is not None:
+                            value = float(value) if any(char in value for char in ".eE") else int(value)
+
+                            if int(cell.get("s", 0)) in date_styles:
+                                value = from_excel(value, epoch)
+
+                row.append(value)
+
+            element.clear()
+
+            yield row_number, row
+
+
+def read_first_sheet(file) -> list[list]:
+    rows = []
+
+    for row_number, row in iter_sheet_rows(file):
+        # Rows without any cell are not always written
+        while len(rows) < row_number - 1:
+            rows.append([])
+
+        rows.append(row)
+
+    return rows
+
+
+def cell_to_text(value) -> str:
+    # Error cells (#N/A, #REF!, ...) are read as empty, like pandas does
+    if value is None or value in ERROR_CODES:
+        return ""
+
+    # Numbers are stored as floats, identifiers must not end with ".0"
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+
+    return str(value)
+
+
+# The first sheet as text, as a rectangle without the trailing empty rows and columns, like pandas reads it
+def read_first_sheet_text(file) -> list[list[str]]:
+    rows = [[cell_to_text(value) for value in row] for row in read_first_sheet(file)]
+
+    while rows and not any(rows[-1]):
+        rows.pop()
+
+    column_amount = max((len(row) - next((idx for idx, value in enumerate(reversed(row)) if value), len(row)) for row in rows), default = 0)
+
+    return [row[:column_amount] + [""] * (column_amount - len(row)) for row in rows]
+
+
+class SharedStrings:
+    # One string table for the whole workbook: every distinct text is stored once, cells only hold its index
+    def __init__(self) -> None:
+        self.indexes = {}
+        self.reference_count = 0
+
+    def index(self, text: str) -> int:
+        self.reference_count += 1
+
+        text_idx = self.indexes.get(text)
+
+        if text_idx is None:
+            if ILLEGAL_CHARACTERS_RE.search(text):
+                raise ValueError("Cell text %r contains characters that cannot be written to a spreadsheet" % text)
+
+            text_idx = len(self.indexes)
+            self.indexes[text] = text_idx
+
+        return text_idx
+
+    def to_xml(self) -> bytes:
+        items = []
+
+        for text in self.indexes:
+            if text != text.strip():
+                items.append("""<si><t xml:space="preserve">%s</t></si>""" % escape(text))
+            else:
+                items.append("<si><t>%s</t></si>" % escape(text))
+
+        return ("""<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<sst xmlns="%s" count="%s" uniqueCount="%s">%s</sst>""" % (MAIN_NAMESPACE, self.reference_count, len(self.indexes), "".join(items))).encode()
+
+
+def cell_xml(cell_ref: str, value, shared_strings: SharedStrings) -> str:
+    if value is None or value == "":
+        return ""
+
+    if isinstance(value, bool):
+        return """<c r="%s" t="b"><v>%d</v></c>""" % (cell_ref, value)
+
+    if isinstance(value, numbers.Integral):
+        return """<c r="%s"><v>%d</v></c>""" % (cell_ref, value)
+
+    if isinstance(value, numbers.Real):
+        return """<c r="%s"><v>%r</v></c>""" % (cell_ref, float(value))
+
+    value = str(value)
+
+    if len(value) > 1 and value.startswith("="):
+        return """<c r="%s"><f>%s</f><v></v></c>""" % (cell_ref, escape(value[1:]))
+
+    if value in ERROR_CODES:
+        return """<c r="%s" t="e"><v>%s</v></c>""" % (cell_ref, value)
+
+    return """<c r="%s" t="s"><v>%s</v></c>""" % (cell_ref, shared_strings.index(value))
+
+
+class CompiledSheet:
+    # A template sheet serialized once, with placeholder slots left for the cells that change from sheet to sheet.
+    # `slots` maps a row index to the first column of its slot, every slot being `slot_width` cells wide.
+    def __init__(self, template_rows: list[list], slots: dict[int, int], slot_width: int, shared_strings: SharedStrings) -> None:
+        self.shared_strings = shared_strings
+        self.slot_rows = []
+        self.slot_refs = []
+        self.chunks = []
+
+        # Template strings are referenced once per stamped sheet, not once per compilation
+        initial_reference_count = shared_strings.reference_count
+
+        chunk = [SHEET_HEAD_XML]
+
+        for row_idx, row in enumerate(template_rows):
+            row_number = row_idx + 1
+            slot_column = slots.get(row_idx)
+
+            row_cells = [
+                cell_xml("%s%s" % (column_letter(column_idx), row_number), value, shared_strings)
+                for column_idx, value in enumerate(row)
+                if slot_column is None or not slot_column <= column_idx < slot_column + slot_width
+            ]
+
+            if slot_column is None:
+                chunk.append("""<row r="%s">%s</row>""" % (row_number, "".join(row_cells)))
+
+                continue
+
+            # Close the static chunk right where the slot cells go
+            chunk.append("""<row r="%s">%s""" % (row_number, "".join(row_cells[:slot_column])))
+            self.chunks.append("".join(chunk).encode())
+
+            self.slot_rows.append(row_idx)
+            self.slot_refs.append(["%s%s" % (column_letter(column_idx), row_number) for column_idx in range(slot_column, slot_column + slot_width)])
+
+            chunk = ["".join(row_cells[slot_column:]), "</row>"]
+
+        chunk.append(SHEET_TAIL_XML)
+        self.chunks.append("".join(chunk).encode())
+
+        self.static_reference_count = shared_strings.reference_count - initial_reference_count
+        shared_strings.reference_count = initial_reference_count
+
+    def stamp(self, slot_values: dict[int, list]) -> bytes:
+        shared_strings = self.shared_strings
+        shared_strings.reference_count += self.static_reference_count
+
+        sheet_parts = [self.chunks[0]]
+
+        for slot_counter, row_idx in enumerate(self.slot_rows):
+            values = slot_values[row_idx]
+
+            sheet_parts.append("".join(cell_xml(cell_ref, value, shared_strings) for cell_ref, value in zip(self.slot_refs[slot_counter], values)).encode())
+            sheet_parts.append(self.chunks[slot_counter + 1])
+
+        return b"".join(sheet_parts)
+
+
+class StampedWorkbookWriter:
+    # Streams sheets into the xlsx archive as soon as they are stamped, the shared strings are written last
+    def __init__(self, file, shared_strings: SharedStrings) -> None:
+        self.shared_strings = shared_strings
+        self.sheet_names = []
+        self.archive = zipfile.ZipFile(file, "w", compression = zipfile.ZIP_DEFLATED)
+
+    def add_sheet(self, sheet_name: str, sheet_xml: bytes) -> None:
+        self.sheet_names.append(sheet_name)
+
+        self.archive.writestr("xl/worksheets/sheet%s.xml" % len(self.sheet_names), sheet_xml)
+
+    def close(self) -> None:
+        sheet_numbers = range(1, len(self.sheet_names) + 1)
+
+        sheets = "".join(
+            """<sheet name="%s" sheetId="%s" r:id="rId%s"/>""" % (escape(sheet_name, {"\"": "&quot;"}), sheet_number, sheet_number)
+            for sheet_number, sheet_name in zip(sheet_numbers, self.sheet_names)
+        )
+
+        self.archive.writestr("[Content_Types].xml", CONTENT_TYPES_XML % "".join(CONTENT_TYPE_SHEET_XML % sheet_number for sheet_number in sheet_numbers))
+        self.archive.writestr("_rels/.rels", ROOT_RELS_XML)
+        self.archive.writestr("xl/workbook.xml", WORKBOOK_XML % sheets)
+        self.archive.writestr("xl/_rels/workbook.xml.rels", WORKBOOK_RELS_XML % "".join(WORKBOOK_SHEET_REL_XML % (sheet_number, sheet_number) for sheet_number in sheet_numbers))
+        self.archive.writestr("xl/styles.xml", STYLES_XML)
+        self.archive.writestr("xl/sharedStrings.xml", self.shared_strings.to_xml())
+
+        self.archive.close()
+
+    def __enter__(self) -> "StampedWorkbookWriter":
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.archive.close()
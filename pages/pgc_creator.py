@@ -1,31 +1,31 @@
+from __future__ import annotations
+
 import streamlit as st
-import pandas as pd
 import io
-import re
 import time
+from collections.abc import Callable
+from typing import TYPE_CHECKING
 
+from core.jobs import get_job_manager
+from core.pgc import TemplateAnalysis, create_batch_sheet, get_target_rows, read_batch_text, read_batch_workbook, read_template
+from core.result_store import get_result_store
+from core.timing import stage, timed_run, timing_enabled
 
-def get_target_rows(template_df: pd.DataFrame) -> None:
-    language_amount = 15 if template_df.iat[0, 17] != "" else 13
+# pandas is only loaded once a template is uploaded, so that opening the page does not wait for it
+if TYPE_CHECKING:
+    import pandas as pd
 
-    target_rows = {"idx": [], "header": [], "tsv_text": [], "language_amount": language_amount}
-    
-    for idx, row in template_df.iterrows():
-        if row.iat[0] != "":
-            if row.iat[3] == "":
-                target_rows["idx"].append(idx)
-                
-                row_header = "%s %s %s (R%s)" % (row.iat[0], row.iat[1], row.iat[2], idx)
-                target_rows["header"].append(row_header)
-
-            if idx > 0:
-                template_df.iat[idx, 0] = int(row.iat[0])
-    
-    get_batch_text(template_df, target_rows)
+
+# Templates are cached by content, so the same template uploaded again (by anyone) is not parsed twice
+@st.cache_data(max_entries = 16, ttl = 3600, show_spinner = False)
+def load_template(template_bytes: bytes) -> pd.DataFrame:
+    return read_template(io.BytesIO(template_bytes))
 
 
 @st.dialog("Batch Text", width = "medium")
 def get_batch_text(template_df: pd.DataFrame, target_rows: dict) -> None:
+    import pandas as pd
+
     st.markdown("Please paste the texts in the fields below. Then, press `Submit`.")
 
     with st.popover("Text Format"):
@@ -36,6 +36,7 @@ def get_batch_text(template_df: pd.DataFrame, target_rows: dict) -> None:
             * Data is formatted as TSV (tab-separated values). If you directly copy/paste the texts from a Microsoft Excel or Google Sheets document, they should already be formatted as TSV (see below for an example of valid text selection)
             * If your selection includes many objects, make sure they are ordered the same across all sheets (e.g. if your selection contains Mushroom, Sweet Flower and Fowl, the text in each sheet should be in order of Mushroom, Sweet Flower and Fowl)
             * For image URLs, you only need to provide one per object (as opposed to one per language per object for normal texts)
+            * Texts spanning several lines are supported, as long as they are quoted the way Microsoft Excel and Google Sheets copy them
             
             Valid text selection example for one field (3 languages, 2 objects):
         """)
@@ -52,79 +53,92 @@ def get_batch_text(template_df: pd.DataFrame, target_rows: dict) -> None:
 
         st.table(selection_example_df)
 
-    for idx, header in zip(target_rows["idx"], target_rows["header"]):
-        st.text_area(
-            header,
-            key = idx,
-            placeholder = "Paste text here"
-        )
+    batch_source = st.radio("Source", ["Pasted text", "Workbook"], horizontal = True, key = "pgc_batch_source")
+
+    if batch_source == "Workbook":
+        st.markdown("Instead of pasting the texts, give the range of cells that holds them for each field: one row per object, and one column per language (or a single column for image URLs).")
+
+        source_xlsx = st.file_uploader("Upload Source Workbook", type = "xlsx", key = "pgc_source_workbook")
+
+        for idx, header in zip(target_rows["idx"], target_rows["header"]):
+            st.text_input(
+                header,
+                key = "pgc_batch_range_%s" % idx,
+                placeholder = "Cell range, e.g. Sheet1!D2:R101 or D2:R"
+            )
+    else:
+        for idx, header in zip(target_rows["idx"], target_rows["header"]):
+            st.text_area(
+                header,
+                key = idx,
+                placeholder = "Paste text here"
+            )
     
     if st.button("Submit", key = "submit_batch_text_button"):
-        with st.spinner("Please wait...", show_time = True):
-            for idx in target_rows["idx"]:
-                batch_text = re.sub("\\n(?!.)", "", st.session_state[idx])
-                tsv_text = tsv_to_list(batch_text)
+        # The batch is timed as part of the run of the template it fills
+        with st.session_state["pgc_timing"]:
+            try:
+                if batch_source == "Workbook":
+                    if source_xlsx is None:
+                        raise ValueError("Please upload the source workbook")
 
-                target_rows["tsv_text"].append(tsv_text)
-            
-            create_batch_sheet(template_df, target_rows)
+                    read_batch_workbook(target_rows, source_xlsx, [st.session_state["pgc_batch_range_%s" % idx] for idx in target_rows["idx"]])
+                else:
+                    read_batch_text(target_rows, [st.session_state[idx] for idx in target_rows["idx"]])
+            except ValueError as error:
+                st.error(str(error), icon = ":material/error:")
+                return
 
-            st.rerun()
+            # The spreadsheet is created in the background, the job is kept in the URL so that a reload does not lose it
+            batch_job = get_job_manager().submit("PGC spreadsheet", create_batch_spreadsheet, template_df, target_rows)
 
+        st.session_state["pgc_batch_spreadsheet"] = None
+        st.query_params["pgc_job"] = batch_job.id
 
-def create_batch_sheet(template_df: pd.DataFrame, target_rows: dict) -> None:
-    target_rows_idx = target_rows["idx"]
-    target_rows_tsv = target_rows["tsv_text"]
-    language_amount = target_rows["language_amount"]
+        st.rerun()
 
-    object_amount = len(target_rows_tsv[0])
-    
-    batch_file = io.BytesIO()
 
-    with pd.ExcelWriter(batch_file) as writer:
-        for processed_df_counter in range(object_amount):
-            # Duplicate the template Dataframe
-            duplicated_df = template_df.copy()
+# The spreadsheet is written straight to the result store, the job only keeps its handle
+def create_batch_spreadsheet(template_df: pd.DataFrame, target_rows: dict, progress: Callable[[int, int], None]) -> str:
+    return get_result_store().put_file(lambda batch_file: create_batch_sheet(template_df, target_rows, batch_file, progress = progress), ".xlsx")
 
-            # For each target row
-            for row_counter in range(len(target_rows_idx)):
-                object_line = target_rows_tsv[row_counter][processed_df_counter]
 
-                # If the object line only has one object (i.e. language), consider it a link
-                if len(object_line) == 1:
-                    link = object_line[0]
+@st.fragment(run_every = 1)
+def show_batch_job(job_id: str) -> None:
+    batch_job = get_job_manager().get(job_id)
 
-                    # Duplicate the link of the line of content to have one per language
-                    for _ in range(language_amount - 1):
-                        object_line.append(link)
-                
-                # Edit the target cells
-                duplicated_df.iloc[target_rows_idx[row_counter], 3:18] = object_line
+    if batch_job is None or batch_job.finished:
+        if batch_job is None:
+            st.session_state["pgc_batch_message"] = "The spreadsheet is no longer available, please process the template again."
+        elif batch_job.status == "done":
+            st.session_state["pgc_batch_spreadsheet"] = batch_job.result
+        elif batch_job.status == "failed":
+            st.session_state["pgc_batch_message"] = "The spreadsheet could not be created: %s" % batch_job.error
+        else:
+            st.session_state["pgc_batch_message"] = "The spreadsheet creation was cancelled."
 
-            # Add the duplicated Dataframe to the batch file
-            sheet_name = "Sheet%s" % processed_df_counter
+        del st.query_params["pgc_job"]
 
-            duplicated_df.to_excel(writer, sheet_name = sheet_name, header = False, index = False)
+        st.rerun()
 
-    batch_file.seek(0)
+    st.progress(batch_job.progress, text = "Creating the PGC spreadsheet... (%s/%s sheets)" % (batch_job.done, batch_job.total))
 
-    st.session_state["pgc_batch_spreadsheet"] = batch_file.getvalue()
+    if st.button("Cancel", key = "cancel_pgc_job_button", icon = ":material/cancel:"):
+        get_job_manager().cancel(job_id)
 
 
-def tsv_to_list(tsv_string:str) -> list[list[str]]:
-    lines = tsv_string.split("\n")
+# Only the handle of the spreadsheet in the result store is kept in the session
+if "pgc_batch_spreadsheet" not in st.session_state:
+    st.session_state["pgc_batch_spreadsheet"] = None
 
-    tsv_list = []
-    
-    for line in lines:
-        values = line.split("\t")
-        tsv_list.append(values)
-    
-    return tsv_list
+if "pgc_template_analysis" not in st.session_state:
+    st.session_state["pgc_template_analysis"] = None
 
+if "pgc_batch_message" not in st.session_state:
+    st.session_state["pgc_batch_message"] = None
 
-if "pgc_batch_spreadsheet" not in st.session_state:
-    st.session_state["pgc_batch_spreadsheet"] = None
+if "pgc_timing" not in st.session_state:
+    st.session_state["pgc_timing"] = timed_run("PGC Creator")
 
 st.title("PGC Creator")
 
@@ -139,7 +153,7 @@ with st.expander("How to Use"):
     1. Import the template PGC spreadsheet you want to use (if you import a template that contains multiple sheets, only the first one will be considered)
     2. If needed, make modifications to the template and preview it in the page's interactive table
     3. Click on the `Process Template` button
-    4. When prompted, fill in the Batch Text form
+    4. When prompted, fill in the Batch Text form, either by pasting the texts or by uploading a workbook that contains them and giving the range of cells of each field
     5. Click on the `Download PGC Spreadsheet` button that just appeared
     6. Load the downloaded file into the WET
     
@@ -151,22 +165,81 @@ st.divider()
 imported_template_xlsx = st.file_uploader("Upload Template", type = "xlsx", key = "import_template_button")
 
 if imported_template_xlsx is not None:
-    imported_template_df = pd.read_excel(imported_template_xlsx, header = None, dtype = str)
+    new_template = st.session_state["pgc_template_analysis"] is None or st.session_state["pgc_template_analysis"][0] != imported_template_xlsx.file_id
+
+    # Every uploaded template starts a new timed run
+    if new_template:
+        st.session_state["pgc_timing"] = timed_run("PGC Creator")
+
+    with st.session_state["pgc_timing"]:
+        imported_template_df = load_template(imported_template_xlsx.getvalue())
+
+        # Analyze the template once per upload. A template that cannot be analyzed (e.g. a note in the identifier column)
+        # can still be fixed in the interactive table, it is analyzed again when processed.
+        if new_template:
+            with stage("analyze_template", rows = len(imported_template_df)):
+                try:
+                    template_analysis = TemplateAnalysis(imported_template_df)
+                except ValueError as error:
+                    template_analysis = None
+
+                    st.error("%s. Please fix the template in the table below before processing it." % error, icon = ":material/error:")
+
+            st.session_state["pgc_template_analysis"] = (imported_template_xlsx.file_id, template_analysis)
 
     template_df = st.data_editor(imported_template_df, num_rows = "dynamic", key = "pgc_template_data")
 
     if st.button("Process Template", type = "primary", key = "process_template_button"):
         template_df.fillna("", inplace = True)
-        get_target_rows(template_df)
+
+        template_analysis = st.session_state["pgc_template_analysis"][1]
+
+        # Edits made in the interactive table may have moved the target rows
+        template_edits = st.session_state["pgc_template_data"]
+
+        try:
+            if template_analysis is None or template_edits["edited_rows"] or template_edits["added_rows"] or template_edits["deleted_rows"]:
+                template_analysis = TemplateAnalysis(template_df)
+        except ValueError as error:
+            st.error(str(error), icon = ":material/error:")
+        else:
+            with st.session_state["pgc_timing"]:
+                target_rows = get_target_rows(template_df, template_analysis)
+
+            get_batch_text(template_df, target_rows)
+
+if "pgc_job" in st.query_params:
+    show_batch_job(st.query_params["pgc_job"])
+
+if st.session_state["pgc_batch_message"] is not None:
+    st.warning(st.session_state["pgc_batch_message"], icon = ":material/warning:")
+
+    st.session_state["pgc_batch_message"] = None
 
 if st.session_state["pgc_batch_spreadsheet"] is not None:
-    epoch_time = time.time()
-
-    st.download_button(
-        "Download PGC spreadsheet",
-        data = st.session_state["pgc_batch_spreadsheet"],
-        file_name = "PGC_BATCH_OUT_%s.xlsx" % int(epoch_time),
-        mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        key = "download_pgc_button",
-        icon = ":material/download:"
-    )
\ No newline at end of file
+    batch_file = get_result_store().open(st.session_state["pgc_batch_spreadsheet"])
+
+    if batch_file is None:
+        st.session_state["pgc_batch_spreadsheet"] = None
+
+        st.warning("The PGC spreadsheet has expired, please process the template again.", icon = ":material/warning:")
+    else:
+        epoch_time = time.time()
+
+        with batch_file:
+            st.download_button(
+                "Download PGC spreadsheet",
+                data = batch_file,
+                file_name = "PGC_BATCH_OUT_%s.xlsx" % int(epoch_time),
+                mime = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                key = "download_pgc_button",
+                icon = ":material/download:"
+            )
+
+# Set HOYOWIKI_TOOLS_TIMING=1 to time each stage of the run
+if timing_enabled():
+    with st.expander("Performance", icon = ":material/speed:"):
+        if st.session_state["pgc_timing"].stages:
+            st.dataframe(st.session_state["pgc_timing"].stages, hide_index = True)
+        else:
+            st.caption("No stage has been timed yet.")
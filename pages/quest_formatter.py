@@ -1,274 +1,175 @@
 import streamlit as st
 import streamlit.components.v1 as components
 import pandas as pd
-import html
 import json
-import re
+import multiprocessing
+import os
+import time
+from collections.abc import Callable
+from concurrent.futures import ProcessPoolExecutor
 
+from core.jobs import get_job_manager
+from core.quest import ClassifiedDialogue, DialogueCache, format_objective, hash_dialogue, hash_translations
+from core.quest_workbook import QuestWorkbook, create_quest_bundle
+from core.result_store import get_result_store
+from core.timing import stage, timed_run, timing_enabled
+from core.translation_memory import LANGUAGES, TranslationMemory, get_translation_memory_path
 
-def format_objective(objective_df: pd.DataFrame) -> None:
-    st.session_state["quest_formatter_html"] = None
 
-    html_data = "<ol>"
+@st.cache_resource
+def get_translation_memory() -> TranslationMemory:
+    return TranslationMemory(get_translation_memory_path())
 
-    for _, row in objective_df.iterrows():
-        if row["header"]:
-            html_data += "<li><p>%s</p></li>" % row["text"]
 
-    html_data += "</ol>"
-    
-    st.session_state["quest_formatter_html"] = html_data
+# Rows and segments already processed are reused when a dialogue is formatted again after a few edits
+@st.cache_resource
+def get_dialogue_cache() -> DialogueCache:
+    return DialogueCache()
+
+
+# Very large dialogues (segment by segment) and the languages of a workbook are rendered on every core, there is no point in a pool on a single core
+@st.cache_resource
+def get_rendering_pool() -> ProcessPoolExecutor | None:
+    if (os.cpu_count() or 1) < 2:
+        return None
+
+    return ProcessPoolExecutor(os.cpu_count(), mp_context = multiprocessing.get_context("spawn"))
+
+
+# The interactive tables are the only DataFrames of the page, the formatter works on the lists of their headers and texts
+def read_table(table_df: pd.DataFrame) -> tuple[list[str], list[str]]:
+    return table_df["header"].fillna("").astype(str).tolist(), table_df["text"].fillna("").astype(str).tolist()
+
+
+# Results are shared by every session, so a dialogue already formatted by anyone is not processed again.
+# The hashed arguments are the cache keys, the arguments starting with an underscore are not hashed.
+@st.cache_data(max_entries = 64, ttl = 3600, show_spinner = False)
+def classify_dialogue_cached(dialogue_hash: str, _headers: list[str], _texts: list[str]) -> tuple[ClassifiedDialogue, list[str]]:
+    return get_dialogue_cache().classify_dialogue(_headers, _texts)
 
 
-def classify_dialogue(dialogue_df: pd.DataFrame) -> None:
+@st.cache_data(max_entries = 64, ttl = 3600, show_spinner = False)
+def format_dialogue_cached(dialogue_hash: str, translations_hash: str, compact: bool, _classified_dialogue: ClassifiedDialogue, _translations: dict[str, str]) -> tuple[str, int | None]:
+    dialogue_cache = get_dialogue_cache()
+
+    rendering_pool = get_rendering_pool()
+
+    html_data = dialogue_cache.format_dialogue(_classified_dialogue, _translations, compact = compact, executor = rendering_pool)
+
+    # Keep the size of the indented output to show what the compact mode saved
+    full_size = len(dialogue_cache.format_dialogue(_classified_dialogue, _translations, executor = rendering_pool).encode()) if compact else None
+
+    return html_data, full_size
+
+
+def process_dialogue(dialogue_df: pd.DataFrame) -> None:
     st.session_state["quest_formatter_html"] = None
 
-    dialogue_df.insert(0, "type", None)
-
-    variable_text = []
-
-    for idx, row in dialogue_df.iterrows():
-        row_type = None
-
-        if "Desc" in row["header"]:
-            row_type = "description"
-
-            dialogue_df.at[idx, "header"] = "Quest Description"
-            variable_text.append("Quest Description")
-        elif "Objective" in row["header"] or row["header"].isdigit():
-            row_type = "objective"
-
-            dialogue_df.at[idx, "header"] = "Quest Objective"
-            variable_text.append("Quest Objective")
-        elif "Missing" in row["header"]:
-            row_type = "missing"
-        elif "Additional" in row["header"] or "Alternative" in row["header"] or "Optional" in row["header"]:
-            row_type = "addopt"
-
-            variable_text.append(row["header"])
-        elif row["header"] == "Choice":
-            row_type = "choice_flag"
-        elif re.search(r"\d+\.\s+", row["header"]):
-            row_type = "choice_branch"
-            
-            choice_speaker = re.search(r"(?:\d+\.\s+)+(.+)", row["header"])
-            
-            if choice_speaker is not None:
-                variable_text.append(choice_speaker[1])
-        elif "," in row["header"]:
-            row_type = "location"
-
-            variable_text.append(row["header"])
-        elif row["header"] and row["text"]:
-            row_type = "dialogue"
-
-            variable_text.append(row["header"])
-        elif row["header"]:
-            row_type = "sub_mission"
-
-            variable_text.append(row["header"])
-        elif row["text"]:
-            row_type = "action"
-        else:
-            row_type = "blank"
-        
-        dialogue_df.at[idx, "type"] = row_type
+    headers, texts = read_table(dialogue_df)
 
-        for variable_group in re.finditer(r"(?:\{[^{}]+\})+", row["text"]):
-            matched_text = variable_group[0]
+    with stage("hash_dialogue", rows = len(headers)):
+        dialogue_hash = hash_dialogue(headers, texts)
 
-            if r"{RUBY#" in matched_text:
-                for ruby_group in re.finditer(r"\s*(\S+)\{RUBY#\[.\](.+)\}(\S+)\s*", row["text"]):
-                    matched_ruby = ruby_group[0]
+    classified_dialogue, variable_text = classify_dialogue_cached(dialogue_hash, headers, texts)
 
-                    base_text = html.escape(ruby_group[1] + ruby_group[3])
-                    ruby_text = html.escape(ruby_group[2])
+    text_to_translate = list(dict.fromkeys(variable_text))
 
-                    formatted_ruby = """<custom-ruby data-ruby="%s|%s"></custom-ruby>""" % (base_text, ruby_text)
+    with stage("lookup_translations", texts = len(text_to_translate)):
+        known_translations = get_translation_memory().lookup(st.session_state["quest_formatter_language"], text_to_translate)
 
-                    dialogue_df.at[idx, "text"] = row["text"].replace(matched_ruby, formatted_ruby)
-            elif r"{NON_BREAK_SPACE}" in matched_text:
-                dialogue_df.at[idx, "text"] = row["text"].replace(r"{NON_BREAK_SPACE}", "&nbsp;")
-            else:
-                variable_text.append(matched_text)
+    # Only ask for the texts that have never been translated before
+    if st.session_state["quest_formatter_reuse_translations"]:
+        text_to_translate = [og_text for og_text in text_to_translate if og_text not in known_translations]
 
-    if len(variable_text) > 0:
-        get_variable_text_translation(dialogue_df, variable_text)
+    if len(text_to_translate) > 0:
+        get_variable_text_translation(dialogue_hash, classified_dialogue, text_to_translate, known_translations)
     else:
-        format_dialogue(dialogue_df)
+        render_dialogue(dialogue_hash, classified_dialogue, known_translations)
+
+
+def render_dialogue(dialogue_hash: str, classified_dialogue: ClassifiedDialogue, translations: dict[str, str]) -> None:
+    html_data, full_size = format_dialogue_cached(
+        dialogue_hash,
+        hash_translations(translations),
+        st.session_state["quest_formatter_compact"],
+        classified_dialogue,
+        translations
+    )
+
+    st.session_state["quest_formatter_html"] = get_result_store().put(html_data, ".html")
+    st.session_state["quest_formatter_full_size"] = full_size
 
 
 @st.dialog("Header & Bracket Content Replacement", width = "medium")
-def get_variable_text_translation(classified_dialogue_df: pd.DataFrame, variable_text: list[str]) -> None:
+def get_variable_text_translation(dialogue_hash: str, classified_dialogue: ClassifiedDialogue, text_to_translate: list[str], known_translations: dict[str, str]) -> None:
     st.markdown("If applicable, please provide a translation of the content below. If not, leave field as is. Then, press `Submit`.")
 
-    text_to_translate = list(dict.fromkeys(variable_text))
-    
     for og_text in text_to_translate:
         st.text_input(
             og_text,
-            value = og_text,
+            value = known_translations.get(og_text, og_text),
             key = og_text,
             placeholder = "Do not leave empty!",
             icon = ":material/translate:"
         )
     
-    text_to_translate.sort(key = lambda og_text: len(og_text), reverse = True)
-    
     if st.button("Submit", key = "submit_translated_text_button"):
-        for og_text in text_to_translate:
-            translated_text = st.session_state[og_text]
+        translations = {og_text: st.session_state[og_text] for og_text in text_to_translate}
+
+        get_translation_memory().store(st.session_state["quest_formatter_language"], translations)
 
-            classified_dialogue_df = classified_dialogue_df.map(lambda text: text.replace(og_text, translated_text))
-        
-        format_dialogue(classified_dialogue_df)
+        # The dialogue is timed as part of the run that asked for the translations
+        with st.session_state["quest_formatter_timing"]:
+            render_dialogue(dialogue_hash, classified_dialogue, known_translations | translations)
 
         st.rerun()
 
 
+# The bundle is written to the result store, the job only keeps its handle
+def create_quest_bundle_result(quest_workbook: QuestWorkbook, translation_memory: TranslationMemory, compact: bool, executor: ProcessPoolExecutor | None, progress: Callable[[int, int], None]) -> str:
+    return get_result_store().put(create_quest_bundle(quest_workbook, translation_memory, compact = compact, progress = progress, executor = executor), ".zip")
 
-def format_dialogue(classified_dialogue_df: pd.DataFrame) -> None:
-    html_data = ""
-
-    opened_tags = []
-
-    for idx, row in classified_dialogue_df.iterrows():
-        last_row_type = classified_dialogue_df.at[idx - 1, "type"] if idx > 0 else None
-        next_row_type = classified_dialogue_df.at[idx + 1, "type"] if idx < (len(classified_dialogue_df) - 1) else None
-
-        match row["type"]:
-            case "description":
-                html_data += """
-                <table>
-                    <tbody>
-                        <tr>
-                            <td colspan="1" rowspan="1">
-                                <p>
-                                    <strong><span style="color: rgb(255, 255, 255);">%s: </span></strong>
-                                    <span style="color: rgb(255, 255, 255);">%s</span>
-                                </p>
-                            </td>
-                        </tr>
-                    </tbody>
-                </table>
-                """ % (row["header"], row["text"])
-            case "objective":
-                html_data += """
-                <table>
-                    <tbody>
-                        <tr>
-                            <td colspan="1" rowspan="1">
-                                <p><strong>%s: </strong>%s</p>
-                            </td>
-                        </tr>
-                    </tbody>
-                </table>
-                """ % (row["header"], row["text"])
-            case "missing":
-                continue
-            case "addopt":
-                html_data += """
-                <p>%s</p>
-                <table>
-                    <tbody>
-                        <tr>
-                            <td colspan="1" rowspan="1">
-                """ % row["header"]
-
-                opened_tags.append("addopt")
-            case "choice_flag":
-                continue
-            case "choice_branch":
-                if last_row_type != "choice_flag":
-                    opened_tags.reverse()
-
-                    html_data += """
-                                </td>
-                            </tr>
-                        </tbody>
-                    </table>
-                    """
-
-                    opened_tags.remove("choice_branch")
-                    
-                    opened_tags.reverse()
-                    
-                row["header"] = re.sub(r"\d+\.\s+", "", row["header"])
-
-                html_data += """
-                <table>
-                    <tbody>
-                        <tr>
-                            <td colspan="1" rowspan="1">
-                                <p><span style="color: rgb(255, 255, 255);">%s: %s</span></p>
-                """ % (row["header"], row["text"])
-
-                opened_tags.append("choice_branch")
-            case "location":
-                html_data += """
-                <p>
-                    <strong><span style="color: rgb(236, 229, 216);">%s</span></strong>
-                </p>
-                """ % row["header"]
-            case "dialogue":
-                if last_row_type == "objective":
-                    html_data += "<p></p>"
-                
-                html_data += """<p><span style="color: rgb(255, 255, 255);">%s: </span>%s</p>""" % (row["header"], row["text"])
-            case "sub_mission":
-                if last_row_type == "objective":
-                    html_data += "<p></p>"
-                
-                html_data += "<p><em>%s</em></p>" % row["header"]
-            case "action":
-                html_data += """
-                <p></p>
-                <table>
-                    <tbody>
-                        <tr>
-                            <td colspan="1" rowspan="1">
-                                <p><span style="color: rgb(255, 255, 255);">%s</span></p>
-                            </td>
-                        </tr>
-                    </tbody>
-                </table>
-                <p></p>
-                """ % row["text"]
-            case "blank":
-                if opened_tags and next_row_type != "choice_flag":
-                    match opened_tags[-1]:
-                        case "addopt" | "choice_branch":
-                            html_data += """
-                                        </td>
-                                    </tr>
-                                </tbody>
-                            </table>
-                            """
-
-                            opened_tags.pop()
-
-                if next_row_type != "choice_branch":
-                    html_data += "<p></p>"
-
-    if opened_tags:
-        for tag in reversed(opened_tags):
-            match tag:
-                case "addopt" | "choice_branch":
-                    html_data += """
-                                </td>
-                            </tr>
-                        </tbody>
-                    </table>
-                    """
-
-                    opened_tags.pop()
-    
-    st.session_state["quest_formatter_html"] = html_data
 
+@st.fragment(run_every = 1)
+def show_bundle_job(job_id: str) -> None:
+    bundle_job = get_job_manager().get(job_id)
 
+    if bundle_job is None or bundle_job.finished:
+        if bundle_job is None:
+            st.session_state["quest_formatter_bundle_message"] = "The HTML bundle is no longer available, please format the workbook again."
+        elif bundle_job.status == "done":
+            st.session_state["quest_formatter_bundle"] = bundle_job.result
+        elif bundle_job.status == "failed":
+            st.session_state["quest_formatter_bundle_message"] = "The workbook could not be formatted: %s" % bundle_job.error
+        else:
+            st.session_state["quest_formatter_bundle_message"] = "The workbook formatting was cancelled."
+
+        del st.query_params["quest_job"]
+
+        st.rerun()
+
+    st.progress(bundle_job.progress, text = "Formatting the workbook... (%s/%s languages)" % (bundle_job.done, bundle_job.total))
+
+    if st.button("Cancel", key = "cancel_quest_job_button", icon = ":material/cancel:"):
+        get_job_manager().cancel(job_id)
+
+
+# Only the handles of the formatted text and of the HTML bundle in the result store are kept in the session
 if "quest_formatter_html" not in st.session_state:
     st.session_state["quest_formatter_html"] = None
 
+if "quest_formatter_full_size" not in st.session_state:
+    st.session_state["quest_formatter_full_size"] = None
+
+if "quest_formatter_bundle" not in st.session_state:
+    st.session_state["quest_formatter_bundle"] = None
+
+if "quest_formatter_bundle_message" not in st.session_state:
+    st.session_state["quest_formatter_bundle_message"] = None
+
+if "quest_formatter_timing" not in st.session_state:
+    st.session_state["quest_formatter_timing"] = timed_run("Quest Formatter")
+
 st.title("Quest Formatter")
 
 st.markdown("""
@@ -297,14 +198,44 @@ with st.expander("How to Use"):
     2. Locate the `Dialogue` header
     3. Starting from the row just below the header, select and copy the first column of dialogue data as well as your language's one (make sure to fill in the Missing Translation fields beforehand, else exclude them from your selection)
     4. Paste your selection in the page's interactive table, under the `Dialogue` tab
-    5. Click on the `Format` button
-    6. If prompted, fill in the Content Replacement form
-    7. Click on the `Copy Formatted Text` button that just appeared
-    8. Paste the formatted text into the WET
+    5. Select your language
+    6. Click on the `Format` button
+    7. If prompted, fill in the Content Replacement form (translations are saved per language, so texts you already translated will not be asked again)
+    8. Click on the `Copy Formatted Text` button that just appeared
+    9. Paste the formatted text into the WET
+    """)
+
+    st.subheader("To Format a Whole Quest in Every Language")
+
+    st.markdown("""
+    1. Download the localization sheet of the quest you're working on as an `.xlsx` file (only its first sheet will be considered)
+    2. Upload it under the `Workbook` tab
+    3. Click on the `Format All Languages` button
+    4. Click on the `Download HTML Bundle` button that just appeared
+    5. Unzip the bundle: it contains one folder per language, with the formatted quest objective and dialogue
+
+    Speaker names, locations and placeholders are replaced with the translations saved for each language. The ones that were never translated are left as they are and listed in the `untranslated.txt` file of the language.
     """)
 
 st.divider()
 
+language_column, reuse_translations_column = st.columns(2, vertical_alignment = "bottom")
+
+language_column.selectbox("Language", LANGUAGES, index = LANGUAGES.index("EN"), key = "quest_formatter_language")
+
+reuse_translations_column.toggle(
+    "Reuse saved translations",
+    value = True,
+    key = "quest_formatter_reuse_translations",
+    help = "Speaker names, locations and placeholders translated before in this language are replaced automatically, and only new ones are shown in the Content Replacement form. When turned off, every text is shown, prefilled with its saved translation."
+)
+
+st.toggle(
+    "Compact output",
+    key = "quest_formatter_compact",
+    help = "Removes indentation, default attributes and long colour styles from the formatted dialogue, empty lines are kept. The result looks the same once pasted into the WET, but is lighter to copy and paste."
+)
+
 default_table_data = {"header": [""], "text": [""]}
 default_table_df = pd.DataFrame(default_table_data)
 
@@ -313,22 +244,80 @@ default_table_config = {
     "text" : st.column_config.TextColumn("Text", width = "large")
 }
 
-objective_tab, dialogue_tab = st.tabs(["Objective", "Dialogue"])
+objective_tab, dialogue_tab, workbook_tab = st.tabs(["Objective", "Dialogue", "Workbook"])
 
 with objective_tab:
     objective_df = st.data_editor(default_table_df, column_config = default_table_config, num_rows = "dynamic", key = "objective_data")
 
     if st.button("Format", type = "primary", key = "format_objective_button"):
-        format_objective(objective_df)
+        st.session_state["quest_formatter_timing"] = timed_run("Quest Formatter")
+
+        with st.session_state["quest_formatter_timing"], stage("format_objective", rows = len(objective_df)):
+            st.session_state["quest_formatter_html"] = get_result_store().put(format_objective(*read_table(objective_df)), ".html")
+            st.session_state["quest_formatter_full_size"] = None
 
 with dialogue_tab:
     dialogue_df = st.data_editor(default_table_df, column_config = default_table_config, num_rows = "dynamic", key = "dialogue_data")
 
     if st.button("Format", type = "primary", key = "format_dialogue_button"):
-        classify_dialogue(dialogue_df)
+        st.session_state["quest_formatter_timing"] = timed_run("Quest Formatter")
+
+        with st.session_state["quest_formatter_timing"]:
+            process_dialogue(dialogue_df)
+
+with workbook_tab:
+    quest_workbook_xlsx = st.file_uploader("Upload Localization Sheet", type = "xlsx", key = "quest_workbook_upload")
+
+    if st.button("Format All Languages", type = "primary", key = "format_workbook_button", disabled = quest_workbook_xlsx is None):
+        st.session_state["quest_formatter_bundle"] = None
+        st.session_state["quest_formatter_timing"] = timed_run("Quest Formatter")
 
-if st.session_state["quest_formatter_html"] is not None:
-    sanitized_html = json.dumps(st.session_state["quest_formatter_html"])
+        with st.session_state["quest_formatter_timing"]:
+            try:
+                quest_workbook = QuestWorkbook(quest_workbook_xlsx)
+            except ValueError as error:
+                st.error(str(error), icon = ":material/error:")
+            else:
+                # The languages are formatted in the background, the job is kept in the URL so that a reload does not lose it
+                bundle_job = get_job_manager().submit("Quest HTML bundle", create_quest_bundle_result, quest_workbook, get_translation_memory(), compact = st.session_state["quest_formatter_compact"], executor = get_rendering_pool())
+
+                st.query_params["quest_job"] = bundle_job.id
+
+    if "quest_job" in st.query_params:
+        show_bundle_job(st.query_params["quest_job"])
+
+    if st.session_state["quest_formatter_bundle_message"] is not None:
+        st.warning(st.session_state["quest_formatter_bundle_message"], icon = ":material/warning:")
+
+        st.session_state["quest_formatter_bundle_message"] = None
+
+    if st.session_state["quest_formatter_bundle"] is not None:
+        bundle_file = get_result_store().open(st.session_state["quest_formatter_bundle"])
+
+        if bundle_file is None:
+            st.session_state["quest_formatter_bundle"] = None
+
+            st.warning("The HTML bundle has expired, please format the workbook again.", icon = ":material/warning:")
+        else:
+            with bundle_file:
+                st.download_button(
+                    "Download HTML Bundle",
+                    data = bundle_file,
+                    file_name = "QUEST_HTML_%s.zip" % int(time.time()),
+                    mime = "application/zip",
+                    key = "download_bundle_button",
+                    icon = ":material/download:"
+                )
+
+html_data = get_result_store().read_text(st.session_state["quest_formatter_html"]) if st.session_state["quest_formatter_html"] is not None else None
+
+if st.session_state["quest_formatter_html"] is not None and html_data is None:
+    st.session_state["quest_formatter_html"] = None
+
+    st.warning("The formatted text has expired, please format it again.", icon = ":material/warning:")
+
+if html_data is not None:
+    sanitized_html = json.dumps(html_data)
 
     copy_html_button = """
     <button style="font-size: 14px; padding: 10px 10px; border-radius: 8px;" onclick="copyHTML()">Copy Formatted Text</button>
@@ -349,4 +338,19 @@ if st.session_state["quest_formatter_html"] is not None:
     </script>
     """ % sanitized_html
 
-    components.html(copy_html_button)
\ No newline at end of file
+    components.html(copy_html_button)
+
+    payload_size = get_result_store().get_size(st.session_state["quest_formatter_html"])
+
+    if st.session_state["quest_formatter_full_size"] is not None:
+        st.caption("Payload size: %.1f KB (%.1f KB before compaction)" % (payload_size / 1024, st.session_state["quest_formatter_full_size"] / 1024))
+    else:
+        st.caption("Payload size: %.1f KB" % (payload_size / 1024))
+
+# Set HOYOWIKI_TOOLS_TIMING=1 to time each stage of the run
+if timing_enabled():
+    with st.expander("Performance", icon = ":material/speed:"):
+        if st.session_state["quest_formatter_timing"].stages:
+            st.dataframe(st.session_state["quest_formatter_timing"].stages, hide_index = True)
+        else:
+            st.caption("No stage has been timed yet.")